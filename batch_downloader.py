@@ -0,0 +1,164 @@
+import json
+import logging
+import os.path
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from file_downloader import MultiDownloader
+from m3u8_downloader import M3U8Downloader, get_datetime_num
+from utils.http_utils import HttpClient, format_http_stats
+from utils.pool_utils import WorkerPool
+from utils.rate_utils import TokenBucket
+
+ITEM_TYPES = ("file", "m3u8")
+FILE_DEFAULTS = {
+    "thread_count": 8,
+    "retry_times": 5,
+}
+M3U8_DEFAULTS = {
+    "base_url": "",
+    "headers": None,
+    "if_random_ug": True,
+    "merge_name": "",
+    "ffmpeg_path": "./utils/ffmpeg.exe",
+    "sp_count": 8,
+    "if_tqdm": False,
+}
+
+
+def load_manifest(path):
+    # one item per line, either a plain url or a json object with "url", an optional "type" ("file" or "m3u8",
+    # guessed from the url otherwise) and any other keyword argument of the downloader, "#" starts a comment
+    items = list()
+    with open(path, encoding="utf-8") as f:
+        for line_num, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            item = json.loads(line) if line.startswith("{") else {"url": line}
+            if not item.get("url"):
+                raise Exception(f"manifest line {line_num} has no url")
+            if not item.get("type"):
+                item["type"] = "m3u8" if urlsplit(item["url"]).path.endswith(".m3u8") else "file"
+            if item["type"] not in ITEM_TYPES:
+                raise Exception(f"manifest line {line_num} has unknown type: {item['type']}, choose one of {ITEM_TYPES}")
+            items.append(item)
+    return items
+
+
+class BatchDownloader:
+    # runs the items of a manifest concurrently, all of them share one HttpClient so keep-alive connections are
+    # reused across items and max_connections / per_host_limit bound the sockets of the whole batch
+    def __init__(self, manifest, save_path=None, max_items=4, max_connections=32, per_host_limit=8, max_speed=None,
+                 file_options=None, m3u8_options=None, metrics=None):
+        self.items = load_manifest(manifest) if isinstance(manifest, str) else list(manifest)
+        current_file_path = os.path.dirname(os.path.abspath(__file__))
+        self.save_path = save_path if save_path else os.path.join(current_file_path, "batch_download")
+        self.max_items = max(max_items, 1)
+        self.max_connections = max_connections
+        self.per_host_limit = per_host_limit
+        self.file_options = dict(FILE_DEFAULTS, **(file_options or dict()))
+        self.m3u8_options = dict(M3U8_DEFAULTS, **(m3u8_options or dict()))
+        self.http = HttpClient(pool_size=max_connections, per_host_limit=per_host_limit,
+                               max_connections=max_connections)
+        # bytes per second for the whole batch, an item's own max_speed applies on top of it
+        self.max_speed = max_speed
+        self.rate_limiter = TokenBucket(max_speed) if max_speed else None
+        # one utils.metrics_utils.Metrics for all items, None gives every item its own
+        self.metrics = metrics
+        self.results = [None] * len(self.items)
+        self.lock = threading.Lock()
+        self.logger = self.get_logger()
+        self.logger.info(f"init batch, items: {len(self.items)}, save_path: {self.save_path}")
+        self.logger.info(f"init batch, max_items: {self.max_items}, max_connections: {self.max_connections}, "
+                         f"per_host_limit: {self.per_host_limit}, max_speed: {self.max_speed}")
+
+    def get_logger(self):
+        logger = logging.getLogger("BatchDownloader")
+        logger.setLevel(logging.INFO)
+        if not logger.handlers:
+            console_handler = logging.StreamHandler()
+            console_handler.setLevel(logging.INFO)
+            console_handler.setFormatter(logging.Formatter("%(asctime)s-%(levelname)s-%(process)s: %(message)s"))
+            logger.addHandler(console_handler)
+        return logger
+
+    def get_downloader(self, index, item):
+        options = {key: value for key, value in item.items() if key not in ("url", "type")}
+        options.setdefault("rate_limiter", self.rate_limiter)
+        if self.metrics:
+            options.setdefault("metrics", self.metrics)
+        if item["type"] == "m3u8":
+            options = dict(self.m3u8_options, **options)
+            options.setdefault("save_dir", self.save_path)
+            # items started in the same second would share get_datetime_num(), resumed items use their own folder
+            if not options.get("resume"):
+                options.setdefault("video_folder", f"{get_datetime_num()}_{index}")
+            return M3U8Downloader(m3u8_url=item["url"], http_client=self.http, **options)
+        options = dict(self.file_options, **options)
+        options.setdefault("save_path", self.save_path)
+        return MultiDownloader(item["url"], http_client=self.http, **options)
+
+    def download_item(self, index):
+        item = self.items[index]
+        start_time = time.time()
+        result = {"url": item["url"], "type": item["type"], "success": False, "size": 0, "spent_time": 0}
+        downloader = None
+        try:
+            downloader = self.get_downloader(index, item)
+            result["success"] = bool(downloader.run())
+        except Exception as e:
+            result["error"] = str(e)
+            self.logger.error(f"item {index} failed, url: {item['url']}, error: {e}")
+        if downloader:
+            result["size"] = downloader.downloaded_size
+        result["spent_time"] = time.time() - start_time
+        with self.lock:
+            self.results[index] = result
+            finished_count = sum(1 for r in self.results if r)
+        self.logger.info("item {} {}, {}/{} finished, size: {} Bytes, spent_time: {:.2f}".format(
+            index, "success" if result["success"] else "failed", finished_count, len(self.items), result["size"],
+            result["spent_time"]))
+
+    def run(self):
+        start_time = time.time()
+        pool = WorkerPool(min(self.max_items, len(self.items)), self.download_item, name="BatchDownloader",
+                          logger=self.logger).start()
+        for index in range(len(self.items)):
+            pool.submit(index, priority=index)
+        pool.close()
+        pool.join()
+        total_time = time.time() - start_time
+        total_size = sum(result["size"] for result in self.results)
+        failed_results = [result for result in self.results if not result["success"]]
+        self.logger.info("batch finished, items: {}, success: {}, failed: {}".format(
+            len(self.results), len(self.results) - len(failed_results), len(failed_results)))
+        self.logger.info("total size %d Bytes (%.2f MB), spent time: %.2f second, aggregate speed: %.2f MB/s" % (
+            total_size, total_size / (1024 * 1024), total_time, total_size / (1024 * 1024) / max(total_time, 0.001)))
+        self.logger.info(format_http_stats(self.http.get_stats()))
+        for result in failed_results:
+            self.logger.warning(f"failed item: {result['url']}, error: {result.get('error')}")
+        self.http.close()
+        return self.results
+
+
+if __name__ == '__main__':
+    manifest_path = sys.argv[1] if len(sys.argv) > 1 else "manifest.txt"
+    params = {
+        "manifest": manifest_path,
+        "save_path": "",
+        "max_items": 4,
+        "max_connections": 32,
+        "per_host_limit": 8,
+        # "max_speed": 1024 * 1024 * 10,
+        "file_options": {
+            # "thread_count": 8,
+        },
+        "m3u8_options": {
+            # "sp_count": 8,
+        },
+    }
+    downloader = BatchDownloader(**params)
+    downloader.run()
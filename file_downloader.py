@@ -1,42 +1,107 @@
+import hashlib
 import logging
 import os.path
+import re
 import sys
 import threading
 import time
-from contextlib import closing
-
-import requests
 
+from utils.concurrency_utils import AdaptiveConcurrency, format_concurrency_stats, is_throttled, request_slot
+from utils.file_utils import RangeWriter
+from utils.hash_utils import PrefixHasher, get_server_digest, parse_expected_digest
+from utils.http_utils import HttpClient, format_http_stats
+from utils.journal_utils import RangeJournal
+from utils.metrics_utils import Metrics
+from utils.rate_utils import get_buckets, limit_rate
+from utils.retry_utils import RetryPolicy, format_retry_stats
+from utils.scheduler_utils import RangeScheduler
 from utils.singleton_utils import singleton
 
+MIN_CHUNK_SIZE = 1024 * 8
+MIN_PAGE_SIZE = 1024 * 1024
+MAX_PAGE_SIZE = 1024 * 1024 * 64
+# one plain request without threads, pages or journal is faster for files up to this size
+SMALL_FILE_SIZE = 1024 * 1024
+STRATEGIES = ("auto", "multi", "single", "small")
+ADAPTIVE_INITIAL_LEVEL = 2
+
 
 class MultiDownloader:
 
     def __init__(self, url, save_path=None, file_name=None, thread_count=10, headers=None, retry_times=5,
-                 log_sys_out=None):
+                 log_sys_out=None, chunk_size=1024 * 100, max_memory=None, use_mmap=False, resume=True,
+                 page_size=None, http_client=None, per_host_limit=None, adaptive=False, max_speed=None,
+                 rate_limiter=None, retry_policy=None, expected_digest=None, verify=True, strategy="auto",
+                 metrics=None):
         self.url = url
         self.headers = headers if isinstance(headers, dict) else dict()
         current_file_path = os.path.dirname(os.path.abspath(__file__))
         self.save_path = save_path if save_path else os.path.join(current_file_path, "multi_download")
         self.total_range = None
+        # True when only a HEAD response reported total_range, the GET of a single download has the final say
+        self.length_from_head = False
+        self.etag = None
+        self.last_modified = None
+        self.server_digest = None
+        self.range_support = None
+        self.partial_header = None
+        if strategy not in STRATEGIES:
+            raise Exception(f"unknown strategy: {strategy}, choose one of {STRATEGIES}")
+        # see utils.metrics_utils for exporters (callback, json lines, prometheus)
+        self.metrics = metrics if metrics else Metrics("file_downloader")
         log_sys_out = sys.stdout if log_sys_out == "sys.stdout" else None
         self.logger = self.get_logger(log_sys_out)
+        self.own_http = http_client is None
+        self.http = http_client if http_client else HttpClient(pool_size=thread_count, per_host_limit=per_host_limit)
         self.get_resp_header_info()
+        # multi: parallel ranges, single: one streaming connection (no range support or unknown size),
+        # small: one request without thread setup
+        self.strategy = self.get_strategy(strategy)
+        # expected_digest: "sha256:<hex>" or "md5:<hex>", otherwise the server's Digest / Content-MD5 / ETag is used
+        self.verify = verify
+        self.digest = self.get_digest(expected_digest)
         if file_name:
             self.file_name = file_name
         if not self.file_name:
             self.file_name = os.path.split(url)[1]
-        self.retry_times = retry_times
-        self.file_lock = threading.Lock()
+        self.retry_policy = retry_policy if retry_policy else RetryPolicy(retry_times)
+        self.retry_times = self.retry_policy.retry_times
+        self.count_lock = threading.Lock()
+        self.use_mmap = use_mmap
+        self.resume = resume
+        self.journal = None
         self.thread_count = thread_count
-        self.failed_thread_list = list()
+        self.page_size = page_size
+        self.scheduler = None
+        # with adaptive, thread_count is the upper bound and the number of requests in flight follows the throughput
+        self.concurrency = AdaptiveConcurrency(thread_count, initial_level=ADAPTIVE_INITIAL_LEVEL, logger=self.logger,
+                                               name="thread_count") if adaptive else None
+        # bytes per second of this download, and/or a TokenBucket shared with other downloads of the process
+        self.max_speed = max_speed
+        self.rate_buckets = get_buckets(max_speed, rate_limiter)
+        self.worker_count = 0
+        self.failed_page_list = list()
         self.finished_thread_count = 0
-        self.chunk_size = 1024 * 100
+        self.downloaded_size = 0
+        self.max_memory = max_memory
+        self.chunk_size = self.get_chunk_size(chunk_size)
         self.logger.info(f"init multi task, url:{self.url}")
         self.logger.info(f"init multi task, sava_path:{self.save_path}")
         self.logger.info(f"init multi task, file_name:{self.file_name}")
-        self.logger.info(f"init multi task, thread_count:{self.thread_count}")
+        self.logger.info(f"init multi task, thread_count:{self.thread_count}, adaptive:{adaptive}")
+        self.logger.info(f"init multi task, total_range:{self.total_range}, range_support:{self.range_support}, "
+                         f"strategy:{self.strategy}")
         self.logger.info(f"init multi task, headers:{self.headers}")
+        self.logger.info(f"init multi task, chunk_size:{self.chunk_size}, max_memory:{self.max_memory}")
+        self.logger.info(f"init multi task, verify:{self.digest if self.verify else False}")
+        self.logger.info(f"init multi task, max_speed:{self.max_speed}, shared rate limit:{rate_limiter is not None}")
+
+    def get_chunk_size(self, chunk_size):
+        # every worker holds at most one chunk in memory, so the ceiling is shared between threads
+        chunk_size = chunk_size if chunk_size and chunk_size > 0 else 1024 * 100
+        if self.max_memory:
+            chunk_size = min(chunk_size, max(self.max_memory // max(self.thread_count, 1), MIN_CHUNK_SIZE))
+        return chunk_size
 
     @singleton
     def get_logger(self, stream=None):
@@ -57,101 +122,376 @@ class MultiDownloader:
         return logger
 
     def get_resp_header_info(self):
-        res = requests.head(self.url, headers=self.headers, allow_redirects=True)
-        res_header = res.headers
-        self.logger.info(f"get_resp_header_info() res_header: {res_header}")
-        content_range = res_header.get("Content-Length", "0")
-        self.total_range = int(content_range)
+        res = None
+        try:
+            res = self.http.head(self.url, headers=self.headers, allow_redirects=True, timeout=30)
+            self.logger.info(f"get_resp_header_info() status: {res.status_code}, res_header: {res.headers}")
+        except Exception as e:
+            self.logger.warning(f"get_resp_header_info() head request error: {e}")
+        res_header = res.headers if res is not None and res.status_code < 400 else dict()
+        accept_ranges = res_header.get("Accept-Ranges", "").lower()
+        if "Content-Length" in res_header and \
+                (accept_ranges == "none" or int(res_header["Content-Length"]) <= SMALL_FILE_SIZE):
+            # single request anyway
+            self.total_range = int(res_header["Content-Length"])
+            self.length_from_head = True
+            self.range_support = accept_ranges == "bytes"
+            self.url = res.url
+        else:
+            # HEAD may be unsupported, lack the length or claim Accept-Ranges without honouring it,
+            # so ask for the first byte
+            probe_header = self.probe_range()
+            res_header = res_header if "Content-Length" in res_header else probe_header
+        self.etag = res_header.get("ETag")
+        self.last_modified = res_header.get("Last-Modified")
+        # Content-MD5 and Digest of a 206 response describe only that part
+        self.server_digest = get_server_digest(res_header) if res_header is not self.partial_header else None
         self.file_name = res_header.get("Content-Disposition", "").replace("attachment;filename=", "").replace('"', '')
-        self.url = res.url
-
-    def page_dispatcher(self, content_size):
-        page_size = content_size // self.thread_count
-        start_pos = 0
-        while start_pos + page_size < content_size:
-            yield {
-                'start_pos': start_pos,
-                'end_pos': start_pos + page_size
-            }
-            start_pos += page_size + 1
-        yield {
-            'start_pos': start_pos,
-            'end_pos': content_size - 1
+
+    def probe_range(self):
+        probe_headers = {"Range": "bytes=0-0"}
+        probe_headers.update(self.headers)
+        with self.http.stream(self.url, headers=probe_headers, timeout=30) as res:
+            self.logger.info(f"probe_range() status: {res.status_code}, res_header: {res.headers}")
+            self.url = res.url
+            if res.status_code == 206:
+                match = re.match(r"bytes \d+-\d+/(\d+)", res.headers.get("Content-Range", ""))
+                self.range_support = bool(match)
+                self.total_range = int(match.group(1)) if match else None
+                self.partial_header = res.headers
+            elif res.status_code == 416 and re.match(r"bytes \*/0$", res.headers.get("Content-Range", "")):
+                # an empty file has no first byte
+                self.range_support = False
+                self.total_range = 0
+            elif res.status_code == 200:
+                # the whole body would follow, it is not read here; no Content-Length means a chunked response
+                self.range_support = False
+                content_length = res.headers.get("Content-Length")
+                self.total_range = int(content_length) if content_length else None
+            else:
+                raise Exception(f"get file info failed, status code: {res.status_code}")
+            return res.headers
+
+    def get_strategy(self, strategy):
+        if strategy == "multi" and self.total_range is None:
+            self.logger.warning("strategy multi needs the file size, the server doesn't report it, use single")
+            return "single"
+        if strategy != "auto":
+            return strategy
+        if not self.range_support or self.total_range is None:
+            return "single"
+        if self.total_range <= SMALL_FILE_SIZE:
+            return "small"
+        return "multi"
+
+    def get_digest(self, expected_digest):
+        # (algorithm, hex digest, source) the finished file is checked against
+        if not self.verify:
+            return None
+        if expected_digest:
+            return parse_expected_digest(expected_digest) + ("expected_digest",)
+        return self.server_digest
+
+    def check_range_response(self, res, start_pos):
+        # (error, is_fatal) for a 206 response that isn't the requested part of this very file
+        content_range = res.headers.get("Content-Range", "")
+        match = re.match(r"bytes (\d+)-(\d+)/(\d+|\*)", content_range)
+        if not match or int(match.group(1)) != start_pos:
+            return f"unexpected Content-Range: {content_range}, requested start: {start_pos}", False
+        if match.group(3) != "*" and int(match.group(3)) != self.total_range:
+            return f"remote file size changed to {match.group(3)}", True
+        etag = res.headers.get("ETag")
+        if self.verify and self.etag and etag and etag != self.etag:
+            return f"remote file changed, ETag: {etag}, expected: {self.etag}", True
+        return None, False
+
+    def verify_file(self, hasher):
+        # True or False for a checked file, None if there is nothing to check against
+        if not hasher:
+            return None
+        digest, tail_size = hasher.finish(self.total_range)
+        self.logger.info(f"{tail_size} Bytes were left to hash after the download")
+        return self.verify_digest(digest)
+
+    def verify_digest(self, digest):
+        algorithm, expected, source = self.digest
+        if digest == expected:
+            self.logger.info(f"verify {algorithm} ({source}) success: {digest}")
+            return True
+        if source == "ETag":
+            self.logger.warning(f"{algorithm} {digest} doesn't match the ETag {expected}, the ETag is not a digest")
+            return None
+        self.logger.error(f"verify {algorithm} ({source}) failed, expected: {expected}, actual: {digest}")
+        return False
+
+    def get_scheduler(self, ranges):
+        missing_size = sum(end_pos - start_pos + 1 for start_pos, end_pos in ranges)
+        page_size = self.page_size
+        if not page_size:
+            # several pages per thread so fast threads keep pulling work, bounded to keep requests reasonable
+            page_size = min(max(missing_size // (self.thread_count * 4), MIN_PAGE_SIZE), MAX_PAGE_SIZE)
+        return RangeScheduler(ranges, page_size, max(self.chunk_size * 2, MIN_PAGE_SIZE // 4))
+
+    def get_journal(self, full_path):
+        validators = {
+            "url": self.url,
+            "content_length": self.total_range,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
         }
+        journal = RangeJournal(f"{full_path}.journal", validators)
+        if not os.path.exists(full_path):
+            journal.remove()
+            return journal
+        if self.resume and journal.load():
+            self.logger.info(f"resume download, completed {journal.completed_size()} Bytes, full_path:{full_path}")
+            if not self.etag and not self.last_modified:
+                self.logger.warning("server returns neither ETag nor Last-Modified, only url and size are checked")
+            return journal
+        self.logger.warning(f"file already exists, remove, full_path:{full_path}")
+        os.remove(full_path)
+        journal.remove()
+        return journal
 
-    def download_range(self, thread_name, page, file_handler):
+    def download_worker(self, thread_name, writer):
         self.logger.info(f"thread {thread_name} start to download")
-        range_headers = {"Range": f'bytes={page["start_pos"]}-{page["end_pos"]}'}
-        range_headers.update(self.headers)
+        while True:
+            page = self.scheduler.next_page(thread_name)
+            self.metrics.set("queue_depth", len(self.scheduler))
+            if not page:
+                break
+            start_time = time.time()
+            is_success = self.download_range(thread_name, page, writer)
+            spent_time = time.time() - start_time
+            self.scheduler.finish_page(thread_name, page, spent_time, is_success)
+            self.metrics.observe("page_seconds", spent_time, success=is_success)
+        with self.count_lock:
+            self.finished_thread_count += 1
+        self.logger.info(f"thread {thread_name} finished, progress: {self.finished_thread_count}/{self.worker_count}")
+
+    def download_range(self, thread_name, page, writer):
         try:
             start_time = time.time()
             is_success = False
+            downloaded_size = 0
+            retry_after = None
+            is_fatal = False
             for i in range(self.retry_times):
-                try:
-                    with closing(requests.get(url=self.url, headers=range_headers, stream=True, timeout=30)) as res:
-                        self.logger.info(f"thread {thread_name} download length: {len(res.content)}")
-                        if res.status_code == 206:
-                            for data in res.iter_content(chunk_size=self.chunk_size):
-                                with self.file_lock:
-                                    file_handler.seek(page["start_pos"])
-                                    file_handler.write(data)
-                                page["start_pos"] += len(data)
-                            is_success = True
-                            break
-                except Exception as e:
-                    self.logger.error(f"download_range() request error: {e}")
-            self.finished_thread_count += 1
+                if i:
+                    self.metrics.inc("retries_total")
+                    self.retry_policy.wait(i - 1, retry_after)
+                    retry_after = None
+                # a retry continues at the first byte that isn't on disk yet
+                current_range = self.scheduler.get_range(page)
+                if not current_range:
+                    is_success = True
+                    break
+                range_headers = {"Range": "bytes={}-{}".format(*current_range)}
+                range_headers.update(self.headers)
+                with request_slot(self.concurrency) as slot:
+                    request_time = time.time()
+                    status = "error"
+                    try:
+                        with self.http.stream(self.url, headers=range_headers, timeout=30) as res:
+                            status = res.status_code
+                            slot["latency"] = res.elapsed.total_seconds()
+                            slot["throttled"] = is_throttled(res.status_code)
+                            self.metrics.observe("ttfb_seconds", slot["latency"])
+                            if res.status_code == 206:
+                                error, is_fatal = self.check_range_response(res, current_range[0])
+                                if error:
+                                    self.logger.warning(f"thread {thread_name} {error}")
+                                    if is_fatal:
+                                        self.retry_policy.record_fatal()
+                                        break
+                                    continue
+                                for data in res.iter_content(chunk_size=self.chunk_size):
+                                    limit_rate(self.rate_buckets, len(data))
+                                    size = self.scheduler.claim(page, len(data))
+                                    if size:
+                                        writer.write(page["start_pos"], data[:size] if size < len(data) else data)
+                                        self.journal.add(page["start_pos"], page["start_pos"] + size - 1)
+                                        self.journal.maybe_flush(writer.sync)
+                                        self.scheduler.advance(page, size)
+                                        downloaded_size += size
+                                        if self.concurrency:
+                                            self.concurrency.add_bytes(size)
+                                    if size < len(data):
+                                        # the tail of this page was stolen by an idle thread
+                                        break
+                                is_success = self.scheduler.get_range(page) is None
+                                if is_success:
+                                    break
+                                self.logger.warning(f"thread {thread_name} response ended early, page: {page}")
+                                continue
+                            self.logger.warning(f"thread {thread_name} unexpected status code: {res.status_code}")
+                            if res.status_code == 200:
+                                # the server ignores Range, run() falls back to a single stream
+                                self.range_support = False
+                            if res.status_code == 200 or not self.retry_policy.is_retryable(res.status_code):
+                                self.retry_policy.record_fatal()
+                                is_fatal = True
+                                break
+                            retry_after = res.headers.get("Retry-After")
+                    except Exception as e:
+                        slot["throttled"] = is_throttled(error=e)
+                        self.logger.error(f"download_range() request error: {e}")
+                    finally:
+                        self.metrics.observe("request_seconds", time.time() - request_time, status=status)
+            with self.count_lock:
+                self.downloaded_size += downloaded_size
             spent_time = time.time() - start_time
+            self.metrics.inc("bytes_total", downloaded_size, worker=thread_name)
+            self.metrics.observe("worker_bytes_per_second", downloaded_size / max(spent_time, 0.001), worker=thread_name)
             if is_success:
-                self.logger.info("thread {} download success, spent_time: {}, progress: {}/{}".format(
-                    thread_name, spent_time, self.finished_thread_count, self.thread_count
+                self.logger.info("thread {} download page success, length: {}, spent_time: {:.2f}{}".format(
+                    thread_name, downloaded_size, spent_time,
+                    f", concurrency: {self.concurrency.level}" if self.concurrency else ""
                 ))
             else:
-                self.logger.error(f"thread {thread_name} download {self.retry_times} times but failed")
-                self.failed_thread_list.append(thread_name)
+                if not is_fatal:
+                    self.retry_policy.record_exhausted()
+                self.logger.error(f"thread {thread_name} download {i + 1} times but failed, page: {page}")
+                self.failed_page_list.append(page)
+            return is_success
         except Exception as e:
             self.logger.error(f"thread {thread_name} download failed: {e}")
-            self.failed_thread_list.append(thread_name)
+            self.failed_page_list.append(page)
+            return False
 
-    def run(self, ):
-        self.logger.info(f"run() get file total range: {self.total_range}")
-        if not self.total_range or self.total_range < 1024:
-            raise Exception("get file total size failed")
-        thread_list = list()
-        full_path = os.path.join(self.save_path, self.file_name)
-        self.logger.info(f"ready to download, full_path: {full_path}")
-        if os.path.exists(full_path):
-            self.logger.warning(f"file already exists, remove, full_path:{full_path}")
-            os.remove(full_path)
-        start_time = time.time()
-        with open(full_path, "wb+") as f:
-            for i, page in enumerate(self.page_dispatcher(self.total_range)):
-                self.logger.info("page: {}, page difference: {}".format(page, page["end_pos"] - page["start_pos"]))
-                thread_list.append(threading.Thread(target=self.download_range, args=(i, page, f)))
+    def download_multi(self, full_path):
+        self.journal = self.get_journal(full_path)
+        missing_ranges = self.journal.missing_ranges(self.total_range)
+        self.scheduler = self.get_scheduler(missing_ranges)
+        self.logger.info(f"missing ranges: {len(missing_ranges)}, pages: {len(self.scheduler)}")
+        with RangeWriter(full_path, self.total_range, use_mmap=self.use_mmap) as writer:
+            # the hash follows the completed start of the file while the download is still running
+            hasher = PrefixHasher(full_path, self.digest[0], self.journal.prefix_size).start() if self.digest else None
+            self.worker_count = min(self.thread_count, len(self.scheduler))
+            thread_list = [threading.Thread(target=self.download_worker, args=(i, writer))
+                           for i in range(self.worker_count)]
             for thread in thread_list:
                 thread.start()
             for thread in thread_list:
                 thread.join()
+            completed_size = self.journal.completed_size()
+            is_verified = None
+            if completed_size == self.total_range:
+                is_verified = self.verify_file(hasher)
+                # a file that fails verification starts over on the next run
+                self.journal.remove()
+            else:
+                if hasher:
+                    hasher.stop()
+                self.journal.flush(writer.sync)
+        return completed_size, is_verified
+
+    def download_single(self, full_path):
+        # the whole body over one connection, written and hashed in order, a failed attempt starts over
+        retry_after = None
+        for i in range(self.retry_times):
+            if i:
+                self.metrics.inc("retries_total")
+                self.retry_policy.wait(i - 1, retry_after)
+                retry_after = None
+            received_size = 0
+            expected_size = self.total_range
+            request_time = time.time()
+            hash_obj = hashlib.new(self.digest[0]) if self.digest else None
+            try:
+                with self.http.stream(self.url, headers=self.headers, timeout=30) as res:
+                    self.metrics.observe("ttfb_seconds", res.elapsed.total_seconds())
+                    if res.status_code != 200:
+                        self.logger.warning(f"download_single() unexpected status code: {res.status_code}")
+                        if not self.retry_policy.is_retryable(res.status_code):
+                            self.retry_policy.record_fatal()
+                            break
+                        retry_after = res.headers.get("Retry-After")
+                        continue
+                    if self.length_from_head:
+                        # HEAD may report a length the GET doesn't have (0 for generated content, a stale cache),
+                        # the body is checked against its own Content-Length, if any
+                        content_length = res.headers.get("Content-Length")
+                        expected_size = int(content_length) if content_length else None
+                    with open(full_path, "wb") as f:
+                        for data in res.iter_content(chunk_size=self.chunk_size):
+                            limit_rate(self.rate_buckets, len(data))
+                            f.write(data)
+                            if hash_obj:
+                                hash_obj.update(data)
+                            received_size += len(data)
+                if expected_size is not None and received_size != expected_size:
+                    raise Exception(f"received {received_size} Bytes, expected {expected_size}")
+                self.total_range = received_size
+                self.downloaded_size = received_size
+                self.metrics.observe("request_seconds", time.time() - request_time, status=200)
+                self.metrics.inc("bytes_total", received_size, worker="single")
+                return received_size, self.verify_digest(hash_obj.hexdigest()) if hash_obj else None
+            except Exception as e:
+                self.logger.error(f"download_single() request error: {e}")
+                self.retry_policy.record_refetch(received_size)
+        self.retry_policy.record_exhausted()
+        return 0, None
+
+    def run(self, ):
+        self.logger.info(f"run() get file total range: {self.total_range}, strategy: {self.strategy}")
+        os.makedirs(self.save_path, exist_ok=True)
+        full_path = os.path.join(self.save_path, self.file_name)
+        self.logger.info(f"ready to download, full_path: {full_path}")
+        start_time = time.time()
+        if self.strategy == "multi":
+            completed_size, is_verified = self.download_multi(full_path)
+            if completed_size != self.total_range and self.range_support is False:
+                self.logger.warning("the server ignores Range requests, download again with a single stream")
+                self.journal.remove()
+                self.failed_page_list.clear()
+                self.strategy = "single"
+                completed_size, is_verified = self.download_single(full_path)
+        else:
+            completed_size, is_verified = self.download_single(full_path)
         try:
             actual_size = os.path.getsize(full_path)
         except Exception as e:
             actual_size = 0
             self.logger.warning(f"get actual file size failed:, full_path: {full_path}, error: {e}")
-        if os.path.exists(full_path) and os.path.getsize(full_path) == 0:
-            self.logger.warning(f"file size is 0, remove, full_path:{full_path}")
+        if os.path.exists(full_path) and completed_size == 0 and self.total_range != 0:
+            self.logger.warning(f"nothing was downloaded, remove, full_path:{full_path}")
             os.remove(full_path)
+            if self.journal:
+                self.journal.remove()
+            actual_size = 0
         total_time = time.time() - start_time
+        total_range = self.total_range or 0
         self.logger.info("download finishing..........")
-        self.logger.info("total size %d Bytes (%.2f MB), actual file size %d Bytes, are they equal? %s" % (
-            self.total_range, self.total_range / (1024 * 1024), actual_size, self.total_range == actual_size,
+        self.logger.info("total size %d Bytes (%.2f MB), completed %d Bytes (%d Bytes this run), actual file size %d Bytes" % (
+            total_range, total_range / (1024 * 1024), completed_size, self.downloaded_size, actual_size,
         ))
         self.logger.info("total spent time: %.2f second, average download speed: %.2f MB/s" % (
-            total_time, actual_size / (1024 * 1024) / total_time
+            total_time, self.downloaded_size / (1024 * 1024) / max(total_time, 0.001)
         ))
-        if self.failed_thread_list:
-            self.logger.info(f"failed_thread_list: {self.failed_thread_list}")
-        final_result = "download success!" if self.total_range == actual_size else "download failed"
+        if self.scheduler:
+            stats = self.scheduler.get_stats()
+            self.logger.info("pages: {}, steals: {}, page time p50/p90/p99/max: {:.2f}/{:.2f}/{:.2f}/{:.2f} second, "
+                             "tail time: {:.2f} second".format(stats["pages"], stats["steals"], stats["p50"],
+                                                               stats["p90"], stats["p99"], stats["max"],
+                                                               stats["tail_time"]))
+        if self.concurrency:
+            self.logger.info(format_concurrency_stats(self.concurrency.get_stats()))
+        retry_stats = self.retry_policy.get_stats()
+        self.logger.info(format_retry_stats(retry_stats))
+        self.logger.info(format_http_stats(self.http.get_stats()))
+        if self.own_http:
+            self.http.close()
+        self.metrics.set("download_seconds", total_time)
+        self.metrics.set("retry_backoff_seconds", retry_stats["backoff_time"])
+        self.metrics.export_summary()
+        if self.failed_page_list:
+            self.logger.info(f"failed_page_list: {self.failed_page_list}")
+        is_success = not self.failed_page_list and self.total_range == actual_size == completed_size and \
+            is_verified is not False
+        final_result = "download success!" if is_success else "download failed"
         self.logger.info(final_result)
+        return is_success
 
 
 if __name__ == '__main__':
@@ -79,7 +79,7 @@ class FileDownloader:
         dir_frame.pack(side="top", fill="x", expand=1)
         save_name_lb = ttkb.Label(self.params_frame, text="保存文件名（可选）")
         save_name_lb.pack(anchor="w")
-        ToolTip(save_name_lb, text="1.若为空，先从远程获取文件名，不行再从下载链接截取\n2.若文件已存在则会删除重新下载")
+        ToolTip(save_name_lb, text="1.若为空，先从远程获取文件名，不行再从下载链接截取\n2.若文件已存在且留有下载记录则断点续传，否则删除重新下载")
         ttkb.Entry(self.params_frame, textvariable=self.target_file_name, width=entry_width).pack(pady=entry_pady)
         ua_lb = ttkb.Label(self.params_frame, text="用户代理（UA）")
         ua_lb.pack(anchor="w")
@@ -87,7 +87,7 @@ class FileDownloader:
         ttkb.Entry(self.params_frame, textvariable=self.target_ua, width=entry_width).pack(pady=entry_pady)
         thread_count_lb = ttkb.Label(self.params_frame, text="线程数 *")
         thread_count_lb.pack(anchor="w")
-        ToolTip(thread_count_lb, text="同时开启多个线程进行分段下载，建议不超过8个，小文件建议1个")
+        ToolTip(thread_count_lb, text="最多同时开启的下载线程数，实际并发数会根据下载速度和服务器限流自动调整，小文件建议1个")
         ttkb.Entry(self.params_frame, textvariable=self.target_thread_count, width=entry_width).pack(pady=entry_pady)
         retry_count_lb = ttkb.Label(self.params_frame, text="重试次数")
         retry_count_lb.pack(anchor="w")
@@ -132,7 +132,7 @@ class FileDownloader:
             return False, "重试次数应为整数"
         param_dict = {
             "url": target_url, "save_path": target_save_path,
-            "thread_count": int(target_thread_count), "retry_times": int(target_retry_times),
+            "thread_count": int(target_thread_count), "retry_times": int(target_retry_times), "adaptive": True,
             "log_sys_out": "sys.stdout",
         }
         if target_file_name:
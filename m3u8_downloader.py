@@ -1,125 +1,531 @@
+import asyncio
+import hashlib
 import logging
 import os.path
+import re
+import shutil
 import sys
+import threading
 import time
+from collections import deque
+from contextlib import closing
 from datetime import datetime
-from threading import Thread, BoundedSemaphore
+from itertools import islice
+from urllib.parse import urljoin, urlsplit
 
 import requests
 from Crypto.Cipher import AES
-from fake_useragent import UserAgent
-
-import m3u8
 from tqdm import tqdm
 
+from utils.concurrency_utils import AdaptiveConcurrency, format_concurrency_stats, is_throttled, request_slot
+from utils.http_utils import HttpClient, format_http_stats
+from utils.journal_utils import SegmentJournal
+from utils.metrics_utils import Metrics
+from utils.merge_utils import FFmpegPipe, SegmentAssembler, find_ffmpeg
+from utils.pool_utils import WorkerPool
+from utils.rate_utils import get_buckets, limit_rate, limit_rate_async
+from utils.retry_utils import RetryPolicy, format_retry_stats
+from utils.ua_utils import get_user_agent
+from utils.url_utils import UrlResolver
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
 
 # pip install requests
-# pip install fake-useragent==0.1.11
-# pip install m3u8
 # pip install pycryptodome
 # pip install tqdm
+# pip install aiohttp (optional, only for engine="asyncio")
+
+DEFAULT_SP_COUNT = 32
+SEGMENT_CHUNK_SIZE = 1024 * 64
+SEGMENT_JOURNAL_NAME = "segments.json"
+# segments are resolved and queued in batches of this size while the playlist is still being read
+PLAYLIST_BATCH_SIZE = 256
+# byte ranges of one resource that follow each other are fetched with one request up to this size
+COALESCE_SIZE = 1024 * 1024 * 8
+# only variants up to this share of the measured throughput are considered
+VARIANT_SAFETY_FACTOR = 0.8
+THROUGHPUT_WINDOW = 20
+ADAPTIVE_INITIAL_LEVEL = 2
+ENGINES = ("thread", "asyncio")
+# besides these a target bitrate in bit/s
+VARIANTS = ("highest", "lowest", "measured")
+# what to do with segments that still fail after the recovery pass
+FAILURE_POLICIES = ("fail", "gap", "fill")
+
+
+ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def parse_attributes(value):
+    # attribute list of a tag (RFC 8216 4.2), quoted strings lose their quotes
+    return {name: item[1:-1] if item.startswith('"') else item for name, item in ATTRIBUTE_PATTERN.findall(value)}
+
+
+def parse_byterange(value, last_end):
+    # "length[@offset]" -> (length, offset), without offset the range starts where the previous one of the same
+    # uri ended
+    length, _, offset = value.partition("@")
+    return int(length), int(offset) if offset else last_end
+
+
+def iter_text_lines(lines):
+    # playlists that went through json come with escaped newlines and slashes, every line is unescaped on its own
+    for line in lines:
+        if "\\" in line:
+            line = line.replace("\\/", "/").encode().decode("unicode_escape")
+            for sub_line in line.split("\n"):
+                yield sub_line.strip()
+        else:
+            yield line.strip()
+
 
 class M3U8Loader:
-    def __init__(self, uri, base_url, segments):
+    # streaming playlist parser: the lines are read from the file or http response while segments() is iterated,
+    # so the first segments can be queued before the whole playlist arrived, and the text is never held at once,
+    # the attributes of the playlist are filled in as their tags are read (is_endlist only at the end)
+    def __init__(self, uri, lines, url=None, source=None):
         self.uri = uri
-        self.base_url = base_url
-        self.segments = segments
+        # where the playlist was really loaded from, after redirects
+        self.url = url or uri
+        self.lines = iter_text_lines(lines)
+        # the open file or response, closed once the playlist is read
+        self.source = source
+        self.version = None
+        self.target_duration = None
+        self.media_sequence = 0
+        self.is_endlist = False
+        self.variants = list()
+        self.keys = list()
+        self.segment_count = 0
+        self.first_segment = None
+        self.records = self.parse()
 
     @classmethod
-    def load(cls, uri, base_url=None):
-        if uri.startswith("http"):
-            res = requests.get(uri, headers={"User-Agent": get_user_agent()})
-            if res.status_code != 200:
-                raise Exception(f"load u3u8 failed when download file, uri: {uri}")
-            text = res.text.encode().decode('unicode_escape')
-            segments = text.split("\n")
+    def load(cls, uri, http_client=None, headers=None, timeout=10):
+        if not uri.startswith("http"):
+            f = open(uri, encoding="utf-8")
+            return M3U8Loader(uri, f, source=f)
+        headers = headers if headers else {"User-Agent": get_user_agent()}
+        if http_client:
+            # not through stream(): the playlist stays open while its first segments download, a slot held that long
+            # would block them (for good with per_host_limit=1)
+            source = closing(http_client.send("GET", uri, headers=headers, timeout=timeout, stream=True,
+                                              allow_redirects=True))
         else:
-            with open(uri, encoding="utf-8") as f:
-                segments = f.read()
-                segments = segments.encode().decode('unicode_escape')
-                segments = segments.split("\n")
-        if not base_url:
-            for line in segments:
+            source = closing(requests.get(uri, headers=headers, timeout=timeout, stream=True))
+        res = source.__enter__()
+        if res.status_code != 200:
+            source.__exit__(None, None, None)
+            raise Exception(f"load m3u8 failed, status code: {res.status_code}, url: {uri}")
+        # a playlist is utf-8 (RFC 8216 4.1), requests would fall back to latin-1 for a text/* type
+        res.encoding = "utf-8"
+        return M3U8Loader(uri, res.iter_lines(chunk_size=1024 * 64, decode_unicode=True), res.url, source)
+
+    @classmethod
+    def detect_base_url(cls, uri, http_client=None):
+        # the directory of the first absolute uri in the playlist, else the directory of the playlist url
+        loader = cls.load(uri, http_client=http_client)
+        try:
+            for line in loader.lines:
                 if line.startswith("http"):
-                    base_url = os.path.split(line.split("?")[0])[0]
+                    return os.path.split(line.split("?")[0])[0]
+        finally:
+            loader.close()
+        if uri.startswith("http"):
+            return str(uri).split("?")[0].rsplit("/", maxsplit=1)[0]
+        return None
+
+    def close(self):
+        if self.source:
+            self.source.__exit__(None, None, None)
+            self.source = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def is_variant(self):
+        return bool(self.variants)
+
+    def read_header(self):
+        # reads up to the first segment, enough to tell a master playlist from a media playlist
+        if self.first_segment is None:
+            self.first_segment = next(self.records, None)
+        return self
+
+    def segments(self):
+        # yields the segment records while the playlist is read, a record is a dict with uri, duration, key,
+        # byterange ((length, offset) or None), sequence and map (the EXT-X-MAP in effect, or None)
+        try:
+            if self.first_segment is not None:
+                segment, self.first_segment = self.first_segment, None
+                yield segment
+            yield from self.records
+        finally:
+            self.close()
+
+    def parse(self):
+        duration = None
+        byterange = None
+        stream_info = None
+        key = None
+        segment_map = None
+        last_uri = None
+        last_end = 0
+        for line in self.lines:
+            if not line:
+                continue
+            if not line.startswith("#"):
+                if stream_info is not None:
+                    self.variants.append(dict(stream_info, uri=line))
+                    stream_info = None
+                    continue
+                if byterange:
+                    byterange = parse_byterange(byterange, last_end if line == last_uri else 0)
+                    last_end = byterange[1] + byterange[0]
+                yield {"uri": line, "duration": duration, "key": key, "byterange": byterange,
+                       "sequence": self.media_sequence + self.segment_count, "map": segment_map}
+                self.segment_count += 1
+                last_uri = line
+                duration = None
+                byterange = None
+                continue
+            tag, _, value = line.partition(":")
+            if tag == "#EXTINF":
+                duration = float(value.split(",", 1)[0] or 0)
+            elif tag == "#EXT-X-BYTERANGE":
+                byterange = value
+            elif tag == "#EXT-X-KEY":
+                attributes = parse_attributes(value)
+                key = {"method": attributes.get("METHOD"), "uri": attributes.get("URI"), "iv": attributes.get("IV")}
+                self.keys.append(key)
+            elif tag == "#EXT-X-MAP":
+                # media initialization section (fMP4), the key in effect applies to it too
+                attributes = parse_attributes(value)
+                map_range = attributes.get("BYTERANGE")
+                segment_map = {"uri": attributes.get("URI"), "key": key,
+                               "byterange": parse_byterange(map_range, 0) if map_range else None}
+            elif tag == "#EXT-X-STREAM-INF":
+                attributes = parse_attributes(value)
+                stream_info = {
+                    "bandwidth": int(attributes.get("BANDWIDTH") or attributes.get("AVERAGE-BANDWIDTH") or 0),
+                    "resolution": attributes.get("RESOLUTION"),
+                }
+            elif tag == "#EXT-X-TARGETDURATION":
+                self.target_duration = float(value)
+            elif tag == "#EXT-X-MEDIA-SEQUENCE":
+                self.media_sequence = int(value)
+            elif tag == "#EXT-X-VERSION":
+                self.version = int(value)
+            elif tag == "#EXT-X-ENDLIST":
+                self.is_endlist = True
+
+
+class SegmentDecryptor:
+    # AES-128-CBC over a stream of chunks, the last block is held back until finish() for the PKCS7 unpadding
+    def __init__(self, key, iv):
+        self.aes = AES.new(key, AES.MODE_CBC, iv)
+        self.rest = b""
+
+    def update(self, data):
+        data = self.rest + data if self.rest else data
+        size = len(data) - (len(data) % AES.block_size or AES.block_size)
+        self.rest = data[size:]
+        return self.aes.decrypt(data[:size]) if size > 0 else b""
+
+    def finish(self):
+        if len(self.rest) % AES.block_size:
+            raise Exception(f"encrypted segment is not a multiple of {AES.block_size} bytes")
+        data = self.aes.decrypt(self.rest) if self.rest else b""
+        self.rest = b""
+        if data and 0 < data[-1] <= AES.block_size and data.endswith(bytes([data[-1]]) * data[-1]):
+            data = data[:-data[-1]]
+        return data
+
+
+class SegmentSplitter:
+    # hands the bytes of one response to the segments it covers: one segment, or several coalesced byte ranges of
+    # the same resource (length None: the rest of the response), every segment with its own decryptor
+    def __init__(self, lengths, decryptors):
+        self.lengths = lengths
+        self.decryptors = decryptors
+        self.chunks = [list() for _ in lengths]
+        self.index = 0
+        self.filled = 0
+
+    def feed(self, data):
+        # returns the time spent decrypting
+        decrypt_time = 0
+        while data:
+            length = self.lengths[self.index]
+            if length is not None and self.filled == length:
+                if self.index == len(self.lengths) - 1:
                     break
-        if not base_url and uri.startswith("http"):
-            base_url = str(uri).split("?")[0].rsplit("/", maxsplit=1)[0]
-        segments = [s.strip() for s in segments]
-        return M3U8Loader(uri, base_url, segments)
+                self.index += 1
+                self.filled = 0
+                continue
+            part = data if length is None else data[:length - self.filled]
+            data = data[len(part):]
+            self.filled += len(part)
+            decryptor = self.decryptors[self.index]
+            if decryptor:
+                decrypt_start = time.perf_counter()
+                part = decryptor.update(part)
+                decrypt_time += time.perf_counter() - decrypt_start
+            self.chunks[self.index].append(part)
+        return decrypt_time
+
+    def finish(self):
+        contents = list()
+        for chunks, decryptor in zip(self.chunks, self.decryptors):
+            if decryptor:
+                chunks.append(decryptor.finish())
+            contents.append(b"".join(chunks))
+        return contents
+
+
+def get_byte_window(segments):
+    # first and last byte (inclusive) of a run of segments, (0, None) for a whole resource
+    if not segments[0]["byterange"]:
+        return 0, None
+    last_length, last_offset = segments[-1]["byterange"]
+    return segments[0]["byterange"][1], last_offset + last_length - 1
+
+
+class SegmentFetch:
+    # the attempts at one segment or one run of coalesced byte ranges, shared by the thread and the asyncio engine:
+    # the Range header of the next attempt, which responses are usable and how their body is cut into segments
+    def __init__(self, segments, get_decryptor, retry_policy):
+        self.segments = segments
+        self.get_decryptor = get_decryptor
+        self.retry_policy = retry_policy
+        self.start, self.end = get_byte_window(segments)
+        self.size = None if self.end is None else self.end + 1 - self.start
+        self.lengths = [segment["byterange"][0] if segment["byterange"] else None for segment in segments]
+        self.splitter = None
+        self.received_size = 0
+        self.skip_size = 0
+        self.decrypt_time = 0
+
+    def get_headers(self, headers):
+        headers = dict(headers or dict())
+        if self.received_size or self.end is not None:
+            # a byte range, or the rest after the bytes of the failed attempt (the decryptors are still there)
+            headers["Range"] = f"bytes={self.start + self.received_size}-{'' if self.end is None else self.end}"
+        return headers
+
+    def start_response(self, status_code, headers):
+        # whether the response carries the content, 200 is the whole resource (again) and the window is cut out of it
+        if status_code != 200 and (status_code != 206 or "Range" not in headers):
+            return False
+        self.skip_size = self.start if status_code == 200 else 0
+        if status_code == 200 or not self.splitter:
+            self.retry_policy.record_refetch(self.received_size)
+            self.received_size = 0
+            self.splitter = SegmentSplitter(self.lengths, [self.get_decryptor(s) for s in self.segments])
+        return True
 
+    def clip(self, data):
+        # the part of a chunk that lies inside the window
+        if self.skip_size:
+            self.skip_size, data = max(self.skip_size - len(data), 0), data[self.skip_size:]
+        if self.size is not None:
+            data = data[:self.size - self.received_size]
+        return data
 
-def decode_video(video_stream, key, iv):
-    if iv and iv and str(iv).startswith("0x") and int(iv, 16):
-        aes = AES.new(bytes(key, encoding='utf8'), AES.MODE_CBC, bytes(iv, encoding='utf8'))
-    else:
-        aes = AES.new(bytes(key, encoding='utf8'), AES.MODE_CBC, bytes(key, encoding='utf8'))
-    return aes.decrypt(video_stream)
+    def feed(self, data):
+        # returns True once the window is complete
+        self.decrypt_time += self.splitter.feed(data)
+        self.received_size += len(data)
+        return self.received_size == self.size
+
+    def finish(self):
+        if self.size is not None and self.received_size < self.size:
+            raise Exception(f"response ended after {self.received_size} of {self.size} Bytes")
+        return self.splitter.finish()
+
+
+def get_key_iv(iv, sequence):
+    # without an IV attribute the media sequence number of the segment is the IV (RFC 8216 5.2)
+    if iv and str(iv).lower().startswith("0x"):
+        return bytes.fromhex(str(iv)[2:].rjust(32, "0"))
+    return int(sequence).to_bytes(16, "big")
 
 
 def get_datetime_num():
     return datetime.strftime(datetime.now(), "%Y%m%d%H%M%S")
 
 
-def get_user_agent():
-    return UserAgent(path="./utils/fake_useragent_0.1.11.json").random
+def get_resume_folder(m3u8_url):
+    # the same playlist always lands in the same folder, so a restarted download finds its segments again
+    return "resume_" + hashlib.md5(m3u8_url.encode("utf-8")).hexdigest()[:16]
 
 
 class M3U8Downloader:
     def __init__(self, m3u8_url, base_url, save_dir, video_folder, headers, if_random_ug, merge_name, ffmpeg_path,
-                 sp_count, if_tqdm):
+                 sp_count, if_tqdm, http_client=None, per_host_limit=None, engine="thread",
+                 stream_merge=True, keep_segments=True, reorder_buffer=64, sticky_ua=False,
+                 live=False, live_duration=None, variant="highest", switch_down=False,
+                 adaptive=False, max_speed=None, rate_limiter=None, retry_times=10, retry_policy=None,
+                 metrics=None, resume=False, recovery_count=2, recovery_policy=None, mirrors=None,
+                 on_failure="fail", url_compat=False, coalesce_size=COALESCE_SIZE):
         self.tqdm = None
         self.if_tqdm = if_tqdm
         self.m3u8_url = m3u8_url
         self.base_url = base_url if base_url else ""
+        self.auto_base_url = not self.base_url.startswith("http")
+        # segment uris are resolved against the playlist url (RFC 3986), url_compat=True keeps the old heuristic of
+        # overlapping them with base_url
+        self.url_compat = url_compat
+        self.url_resolver = None
+        self.playlist_url = None
+        # the media playlist while it is still read, and the batches of its segments
+        self.playlist = None
+        self.segment_batches = None
+        self.playlist_error = None
         self.to_download_url = list()
         self.download_failed_dict = dict()
-        self.key_method = None
-        self.key_iv = None
-        self.key_str = None
+        self.segments = list()
+        self.segment_lock = threading.Lock()
+        self.started_segments = set()
+        self.downloaded_size = 0
+        # "2000000" from a json manifest means the same as 2000000
+        if isinstance(variant, str) and variant.isdigit():
+            variant = int(variant)
+        if variant not in VARIANTS and (type(variant) is not int or variant <= 0):
+            raise Exception(f"unknown variant: {variant}, choose one of {VARIANTS} or a bitrate in bit/s")
+        self.variant = variant
+        self.variants = list()
+        self.variant_index = None
+        # a switch mixes qualities and resolutions in one file, for a VOD a slow link only makes it take longer
+        self.switch_down = switch_down
+        self.throughput_samples = deque()
+        self.throughput_lock = threading.Lock()
+        self.slow_count = 0
+        self.key_cache = dict()
+        self.key_lock = threading.Lock()
+        # EXT-X-MAP init sections, each one is requested once
+        self.init_cache = dict()
+        self.init_lock = threading.Lock()
+        self.init_tasks = dict()
+        # EXT-X-BYTERANGE segments: adjacent ranges are merged into requests of at most coalesce_size bytes
+        self.coalesce_size = coalesce_size
+        self.segment_jobs = dict()
+        self.coalesced_count = 0
         self.current_file_path = os.path.dirname(os.path.abspath(__file__))
         self.save_dir = save_dir if save_dir else os.path.join(self.current_file_path, "m3u8_download")
-        self.video_folder = video_folder if video_folder else get_datetime_num()
-        if not os.path.isabs(ffmpeg_path):
+        # resume: True skips segments whose file is on disk with the recorded size, "verify" also checks the md5
+        self.resume = resume if resume and not live else False
+        self.journal = None
+        self.resumed_segments = dict()
+        self.resumed_size = 0
+        if video_folder:
+            self.video_folder = video_folder
+        else:
+            self.video_folder = get_resume_folder(m3u8_url) if self.resume else get_datetime_num()
+        if ffmpeg_path and not os.path.isabs(ffmpeg_path):
             ffmpeg_path = os.path.join(self.current_file_path, ffmpeg_path)
         self.headers = headers if isinstance(headers, dict) else dict()
         self.if_random_ug = if_random_ug if isinstance(if_random_ug, bool) else True
-        self.ffmpeg_path = ffmpeg_path
+        # one user agent for the whole keep-alive session instead of a new one per request
+        self.sticky_ua = get_user_agent() if sticky_ua and self.if_random_ug else None
+        self.ffmpeg_path = find_ffmpeg(ffmpeg_path)
         self.merge_name = merge_name if merge_name else "merge.ts"
         self.file_type = ".ts"
-        self.semaphore = BoundedSemaphore(sp_count) if sp_count else None
+        self.sp_count = sp_count if sp_count and sp_count > 0 else DEFAULT_SP_COUNT
+        self.per_host_limit = per_host_limit
+        if engine not in ENGINES:
+            raise Exception(f"unknown engine: {engine}, choose one of {ENGINES}")
+        if engine == "asyncio" and aiohttp is None:
+            raise Exception("engine asyncio requires aiohttp, please run: pip install aiohttp")
+        self.engine = engine
+        self.stream_merge = stream_merge
+        # a resumed download needs the files of the earlier run
+        self.keep_segments = keep_segments or bool(self.resume)
+        self.reorder_buffer = reorder_buffer
+        self.assembler = None
+        self.live = live
+        self.live_duration = live_duration
+        self.live_ended = False
+        self.target_duration = None
+        # the highest media sequence number queued so far, every live segment up to it has been seen
+        self.last_sequence = None
+        self.stop_event = threading.Event()
         self.logger = self.get_logger()
+        # see utils.metrics_utils for exporters (callback, json lines, prometheus)
+        self.metrics = metrics if metrics else Metrics("m3u8_downloader")
+        self.pool = None
+        # with adaptive, sp_count is the upper bound and the number of requests in flight follows the throughput
+        self.concurrency = AdaptiveConcurrency(self.sp_count, initial_level=ADAPTIVE_INITIAL_LEVEL, logger=self.logger,
+                                               name="sp_count") if adaptive else None
+        # bytes per second of this download, and/or a TokenBucket shared with other downloads of the process
+        self.max_speed = max_speed
+        self.rate_buckets = get_buckets(max_speed, rate_limiter)
+        self.retry_policy = retry_policy if retry_policy else RetryPolicy(retry_times)
+        # failed segments get another pass after the main one, with fewer threads, a longer backoff and the mirrors
+        self.recovery_count = max(recovery_count or 0, 0)
+        self.recovery_policy = recovery_policy if recovery_policy else RetryPolicy(5, base_delay=2.0, max_delay=60.0)
+        self.mirrors = list(mirrors or list())
+        if on_failure not in FAILURE_POLICIES:
+            raise Exception(f"unknown on_failure: {on_failure}, choose one of {FAILURE_POLICIES}")
+        self.on_failure = on_failure
+        self.patched_segments = dict()
+        self.own_http = http_client is None
+        self.http = http_client if http_client else HttpClient(pool_size=self.sp_count, per_host_limit=per_host_limit)
         self.normalize_m3u8_file(self.m3u8_url)
         self.normalize_base_url()
         self.logger.info(f"init info m3u8_url: {self.m3u8_url}")
-        self.logger.info(f"init info base_url: {self.base_url}")
-        self.logger.info(f"init info if_random_ug: {self.if_random_ug}")
+        self.logger.info(f"init info base_url: {self.base_url}, url_compat: {self.url_compat}")
+        self.logger.info(f"init info if_random_ug: {self.if_random_ug}, sticky_ua: {self.sticky_ua}")
         self.logger.info(f"init info headers: {self.headers}")
         self.logger.info(f"init info save_dir: {self.save_dir}")
         self.logger.info(f"init info video_folder: {self.video_folder}")
         self.logger.info(f"init info current_file_path: {self.current_file_path}")
         self.logger.info(f"init info ffmpeg_path: {self.ffmpeg_path}")
         self.logger.info(f"init info merge_name: {self.merge_name}")
+        self.logger.info(f"init info sp_count: {self.sp_count}, adaptive: {adaptive}")
+        self.logger.info(f"init info max_speed: {self.max_speed}, shared rate limit: {rate_limiter is not None}")
+        self.logger.info(f"init info engine: {self.engine}, coalesce_size: {self.coalesce_size}")
+        self.logger.info(f"init info live: {self.live}, live_duration: {self.live_duration}")
+        self.logger.info(f"init info variant: {self.variant}, switch_down: {self.switch_down}")
+        self.logger.info(f"init info stream_merge: {self.stream_merge}, keep_segments: {self.keep_segments}")
+        self.logger.info(f"init info resume: {self.resume}")
+        self.logger.info(f"init info recovery_count: {self.recovery_count}, mirrors: {self.mirrors}, "
+                         f"on_failure: {self.on_failure}")
+        if resume and live:
+            self.logger.warning("resume is not supported for live streams, ignored")
 
     def __del__(self):
         if self.tqdm:
             self.tqdm.close()
 
     def get_headers(self):
-        headers = self.headers
+        headers = dict(self.headers)
         if self.if_random_ug:
-            headers.update({"User-Agent": get_user_agent()})
+            headers.update({"User-Agent": self.sticky_ua or get_user_agent()})
         return headers
 
+    def get_segment_headers(self):
+        # custom headers (e.g. Host) are meant for the playlist, segments only get the user agent
+        return {"User-Agent": self.sticky_ua or get_user_agent()} if self.if_random_ug else None
+
     def get_logger(self):
         logger = logging.getLogger("M3U8Downloader")
         logger.setLevel(logging.INFO)
+        os.makedirs(self.save_dir, exist_ok=True)
+        if logger.handlers:
+            # several downloaders in one process (e.g. a batch) share the logger
+            return logger
         formatter = logging.Formatter("%(asctime)s-%(filename)s-line:%(lineno)d-%(levelname)s-%(process)s: %(message)s")
         console_handler = logging.StreamHandler()
         console_handler.setLevel(logging.INFO)
         console_handler.setFormatter(formatter)
-        if not os.path.exists(self.save_dir):
-            os.mkdir(self.save_dir)
         file_handler = logging.FileHandler(os.path.join(self.save_dir, "m3u8_download.log"), encoding="utf-8")
         file_handler.setLevel(logging.INFO)
         file_handler.setFormatter(formatter)
@@ -127,79 +533,672 @@ class M3U8Downloader:
         logger.addHandler(file_handler)
         return logger
 
+    def load_m3u8(self):
+        playlist = M3U8Loader.load(self.m3u8_url, http_client=self.http, headers=self.get_headers())
+        if self.m3u8_url.startswith("http"):
+            # relative uris are relative to where the playlist really is, after redirects
+            self.playlist_url = playlist.url
+        return playlist
+
+    def iter_segment_batches(self, playlist, batch_size=PLAYLIST_BATCH_SIZE):
+        # segments of the playlist while it is read, each batch of uris is resolved in one pass
+        resolver = self.get_url_resolver()
+        segment_keys = dict()
+        segment_maps = dict()
+        records = playlist.segments()
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                return
+            segments = list()
+            for record, d_url in zip(batch, resolver.resolve_all([record["uri"] for record in batch])):
+                key = record["key"]
+                cache_key = (key["method"], key["uri"], key["iv"]) if key else None
+                if cache_key not in segment_keys:
+                    segment_keys[cache_key] = self.get_segment_key(key)
+                segment_map = record["map"]
+                map_key = None
+                if segment_map:
+                    map_key = (segment_map["uri"], segment_map["byterange"],
+                               tuple(segment_map["key"].values()) if segment_map["key"] else None)
+                    if map_key not in segment_maps:
+                        segment_maps[map_key] = {"url": resolver.resolve(segment_map["uri"]),
+                                                 "byterange": segment_map["byterange"],
+                                                 "key": self.get_segment_key(segment_map["key"])}
+                if d_url:
+                    segments.append({"url": d_url, "sequence": record["sequence"], "key": segment_keys[cache_key],
+                                     "duration": record["duration"], "byterange": record["byterange"],
+                                     "map": segment_maps.get(map_key)})
+            yield segments
+
+    def parse_segments(self, playlist):
+        return [segment for segments in self.iter_segment_batches(playlist) for segment in segments]
+
+    def add_segments(self, segments):
+        segment_keys = [segment["key"] for segment in segments] + [segment["map"]["key"] for segment in segments
+                                                                   if segment["map"]]
+        for key_url in {segment_key["uri"] for segment_key in segment_keys if segment_key}:
+            self.get_key(key_url)
+        with self.segment_lock:
+            first_index = len(self.segments)
+            self.segments.extend(segments)
+            self.to_download_url.extend(segment["url"] for segment in segments)
+        if self.tqdm and (self.live or self.segment_batches):
+            self.tqdm.total = len(self.segments)
+            self.tqdm.refresh()
+        return list(range(first_index, len(self.segments)))
+
+    def filter_new_segments(self, segments):
+        # the media sequence number identifies a segment, also across variants, and only grows (RFC 8216 6.2.2)
+        new_segments = [segment for segment in segments
+                        if self.last_sequence is None or segment["sequence"] > self.last_sequence]
+        if new_segments:
+            self.last_sequence = max(segment["sequence"] for segment in new_segments)
+        return new_segments
+
     def get_m3u8_info(self):
-        m3u8_obj = m3u8.load(self.m3u8_url, timeout=10, headers=self.get_headers())
-        keys = m3u8_obj.keys
-        if keys and keys[-1]:
-            key_alg = keys[-1].method
-            if key_alg != "AES-128":
-                raise Exception(f"matched key but algorithm ({key_alg}) is not AES-128")
-            self.key_method = key_alg
-            self.key_iv = keys[-1].iv
-            self.get_key(self.normalize_url(keys[-1].absolute_uri))
-        self.to_download_url = [self.normalize_url(segment.uri) for segment in m3u8_obj.segments]
-        self.to_download_url = [d_url for d_url in self.to_download_url if d_url]
-        if not self.to_download_url:
-            loader_obj = M3U8Loader.load(self.m3u8_url, self.base_url)
-            self.to_download_url = [self.normalize_url(segment) for segment in loader_obj.segments]
-            self.to_download_url = [d_url for d_url in self.to_download_url if d_url]
+        playlist = self.load_m3u8().read_header()
+        if playlist.is_variant:
+            playlist.close()
+            self.select_variant(playlist)
+            playlist = self.load_m3u8().read_header()
+        self.target_duration = playlist.target_duration or 10
+        self.segments = list()
+        self.to_download_url = list()
+        self.tqdm = tqdm(total=None, desc="download progress") if self.if_tqdm else None
+        self.playlist = playlist
+        self.segment_batches = self.iter_segment_batches(playlist)
+        if self.live:
+            # a live playlist is only a short window, it is read completely
+            segments = [segment for segments in self.segment_batches for segment in segments]
+            self.add_segments(self.filter_new_segments(segments))
+            self.finish_playlist()
+        else:
+            # only the first batch, the rest is read while the first segments download
+            self.read_playlist_batch()
         self.logger.info(f"to_download_url: {len(self.to_download_url)} {self.to_download_url[:5]}, ...")
-        self.tqdm = tqdm(total=len(self.to_download_url), desc="download progress") if self.if_tqdm else None
         if self.to_download_url:
             self.file_type = os.path.splitext(self.to_download_url[0].split("?")[0])[1]
 
+    def read_playlist_batch(self):
+        # adds the next batch of segments of the playlist, returns their indexes, [] once the playlist is read
+        try:
+            segments = next(self.segment_batches, None) if self.segment_batches else None
+        except Exception as e:
+            # the segments read so far still download, run() raises afterwards
+            self.logger.error(f"reading the playlist failed after {len(self.segments)} segments: {e}")
+            self.playlist_error = e
+            segments = None
+        if segments is None:
+            self.finish_playlist()
+            return list()
+        return self.add_segments(segments)
+
+    def finish_playlist(self):
+        if not self.playlist:
+            return
+        self.live_ended = bool(self.playlist.is_endlist)
+        if not self.live and not self.playlist.is_endlist and self.segments:
+            self.logger.warning("the playlist has no EXT-X-ENDLIST, if it is a live stream use live=True")
+        self.playlist.close()
+        self.playlist = None
+        self.segment_batches = None
+        if self.tqdm and not self.live:
+            self.tqdm.total = len(self.segments)
+            self.tqdm.refresh()
+        self.logger.info(f"playlist read, segments: {len(self.segments)}, encrypted segments: "
+                         f"{sum(1 for segment in self.segments if segment['key'])}, distinct keys: {len(self.key_cache)}")
+
+    def select_variant(self, playlist):
+        self.variants = sorted([{
+            "url": urljoin(playlist.url, variant["uri"]),
+            "bandwidth": variant["bandwidth"],
+            "resolution": variant["resolution"],
+        } for variant in playlist.variants], key=lambda v: v["bandwidth"])
+        if not self.variants:
+            raise Exception("master playlist has no variant stream")
+        for i, variant in enumerate(self.variants):
+            self.logger.info(f"variant {i}: bandwidth {variant['bandwidth']}, resolution {variant['resolution']}, "
+                             f"url: {variant['url']}")
+        if self.variant == "lowest":
+            index = 0
+        elif self.variant == "measured":
+            index = self.get_variant_index(self.measure_throughput() * VARIANT_SAFETY_FACTOR)
+        elif isinstance(self.variant, int):
+            index = self.get_variant_index(self.variant)
+        else:
+            index = len(self.variants) - 1
+        self.use_variant(index)
+
+    def get_variant_index(self, bandwidth):
+        # the best variant whose bandwidth fits, the lowest one if none does
+        indexes = [i for i, variant in enumerate(self.variants) if variant["bandwidth"] <= bandwidth]
+        return indexes[-1] if indexes else 0
+
+    def use_variant(self, index):
+        self.variant_index = index
+        self.m3u8_url = self.variants[index]["url"]
+        self.playlist_url = None
+        if self.auto_base_url:
+            self.base_url = self.m3u8_url.split("?")[0].rsplit("/", maxsplit=1)[0]
+        self.logger.info(f"use variant {index}, bandwidth: {self.variants[index]['bandwidth']}, "
+                         f"m3u8_url: {self.m3u8_url}")
+
+    def measure_throughput(self, probe_count=3):
+        # download the first segments of the lowest variant in parallel, returns bits per second
+        self.use_variant(0)
+        playlist = self.load_m3u8()
+        segments = next(self.iter_segment_batches(playlist, probe_count), list())
+        playlist.close()
+        sizes = list()
+
+        def probe(segment):
+            headers = dict(self.get_segment_headers() or dict())
+            if segment["byterange"]:
+                start, end = get_byte_window([segment])
+                headers["Range"] = f"bytes={start}-{end}"
+            try:
+                with self.http.stream(segment["url"], headers=headers, timeout=10) as res:
+                    sizes.append(len(res.content) if res.status_code in (200, 206) else 0)
+            except Exception as e:
+                self.logger.warning(f"measure throughput failed, url: {segment['url']}, error: {e}")
+
+        start_time = time.time()
+        threads = [threading.Thread(target=probe, args=(segment,)) for segment in segments]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        throughput = sum(sizes) * 8 / max(time.time() - start_time, 0.001)
+        self.logger.info(f"measured throughput: {throughput / 1000:.0f} kbit/s from {len(sizes)} segments")
+        return throughput
+
+    def record_throughput(self, size):
+        # sliding window of finished segments, returns the throughput in bits per second once the window is full
+        now = time.time()
+        with self.throughput_lock:
+            self.throughput_samples.append((now, size))
+            while self.throughput_samples and now - self.throughput_samples[0][0] > THROUGHPUT_WINDOW:
+                self.throughput_samples.popleft()
+            if len(self.throughput_samples) < 8 or now - self.throughput_samples[0][0] < THROUGHPUT_WINDOW / 2:
+                return None
+            return sum(sample[1] for sample in self.throughput_samples) * 8 / (now - self.throughput_samples[0][0])
+
+    def check_switch_down(self, size):
+        # not while the playlist is still read, its later segments would come from the old variant
+        if not self.switch_down or not self.variant_index or self.segment_batches:
+            return
+        throughput = self.record_throughput(size)
+        if throughput is None:
+            return
+        with self.throughput_lock:
+            if throughput >= self.variants[self.variant_index]["bandwidth"]:
+                self.slow_count = 0
+                return
+            self.slow_count += 1
+            if self.slow_count < 3:
+                return
+            self.slow_count = 0
+            self.throughput_samples.clear()
+            index = min(self.get_variant_index(throughput * VARIANT_SAFETY_FACTOR), self.variant_index - 1)
+        self.logger.warning(f"throughput {throughput / 1000:.0f} kbit/s can't sustain variant {self.variant_index}, "
+                            f"switch down to variant {index}")
+        self.switch_variant(index)
+
+    def switch_variant(self, index):
+        old_index = self.variant_index
+        self.use_variant(index)
+        try:
+            segments = self.parse_segments(self.load_m3u8())
+            for key_url in {segment["key"]["uri"] for segment in segments if segment["key"]}:
+                self.get_key(key_url)
+        except Exception as e:
+            self.logger.error(f"switch to variant {index} failed: {e}")
+            self.use_variant(old_index)
+            return
+        # variants are aligned by media sequence number
+        by_sequence = {segment["sequence"]: segment for segment in segments}
+        replaced_count = 0
+        with self.segment_lock:
+            for idx, segment in enumerate(self.segments):
+                # released live segments are done, they only kept their map
+                if idx in self.started_segments or "sequence" not in segment:
+                    continue
+                new_segment = by_sequence.get(segment["sequence"])
+                if new_segment:
+                    self.segments[idx] = new_segment
+                    self.to_download_url[idx] = new_segment["url"]
+                    replaced_count += 1
+        self.logger.info(f"switched to variant {index}, {replaced_count} pending segments replaced")
+
+    def download_live(self, pool):
+        # re-poll the playlist at the target duration cadence and queue segments that were not seen yet
+        deadline = time.time() + self.live_duration if self.live_duration else None
+        has_new_segments = True
+        while not self.live_ended and not self.stop_event.is_set():
+            if deadline and time.time() >= deadline:
+                self.logger.info(f"live capture reached live_duration: {self.live_duration}s")
+                break
+            # an unchanged playlist is polled again after half the target duration (RFC 8216 6.3.4)
+            wait_time = self.target_duration if has_new_segments else self.target_duration / 2
+            if deadline:
+                wait_time = min(wait_time, max(deadline - time.time(), 0))
+            try:
+                if self.stop_event.wait(wait_time):
+                    break
+                playlist = self.load_m3u8()
+                segments = self.parse_segments(playlist)
+            except KeyboardInterrupt:
+                self.logger.warning("live capture stopped by user")
+                break
+            except Exception as e:
+                self.logger.error(f"reload live playlist failed: {e}")
+                has_new_segments = False
+                continue
+            self.target_duration = playlist.target_duration or self.target_duration
+            self.live_ended = bool(playlist.is_endlist)
+            new_segments = self.filter_new_segments(segments)
+            has_new_segments = bool(new_segments)
+            for idx in self.add_segments(new_segments):
+                pool.submit(idx, priority=idx)
+            if new_segments:
+                self.logger.info(f"live playlist: {len(new_segments)} new segments, total {len(self.segments)}")
+        if self.live_ended:
+            self.logger.info("live playlist ended (EXT-X-ENDLIST)")
+
+    def stop(self):
+        self.stop_event.set()
+
+    def get_segment_key(self, key):
+        if not key or not key["method"] or key["method"] == "NONE":
+            return None
+        if key["method"] != "AES-128":
+            raise Exception(f"matched key but algorithm ({key['method']}) is not AES-128")
+        return {"method": key["method"], "uri": self.normalize_url(key["uri"]), "iv": key["iv"]}
+
     def get_key(self, key_url):
-        self.logger.info(f"key_url: {key_url}")
-        res = requests.get(key_url, headers=self.get_headers(), timeout=10)
-        self.key_str = res.text
-        if not self.key_str:
-            raise Exception("get key error, key: {}".format(self.key_str))
-        self.logger.info(f"get_key key_str: {self.key_str}")
+        # each distinct key uri is only requested once
+        with self.key_lock:
+            if key_url in self.key_cache:
+                return self.key_cache[key_url]
+            self.logger.info(f"key_url: {key_url}")
+            res = self.http.get(key_url, headers=self.get_headers(), timeout=10)
+            key = res.content
+            if res.status_code != 200 or len(key) != 16:
+                raise Exception("get key error, status code: {}, key: {}".format(res.status_code, key))
+            self.logger.info(f"get_key key: {key.hex()}")
+            self.key_cache[key_url] = key
+            return key
+
+    def get_decryptor(self, segment):
+        segment_key = segment["key"]
+        if not segment_key:
+            return None
+        iv = get_key_iv(segment_key["iv"], segment["sequence"])
+        return SegmentDecryptor(self.get_key(segment_key["uri"]), iv)
+
+    def start_segment(self, number):
+        # once a segment has started it keeps its variant, a switch only replaces segments not started yet
+        with self.segment_lock:
+            self.started_segments.add(number)
+            return self.segments[number]
 
     def test_download(self, d_url):
         self.logger.info(f"test download url: {d_url}")
         try:
-            res = requests.get(d_url, timeout=30, headers=self.get_headers(), stream=True)
-            return True if res.status_code < 300 else False
+            with self.http.stream(d_url, timeout=30, headers=self.get_headers()) as res:
+                return True if res.status_code < 300 else False
         except Exception as e:
             self.logger.error(f"test_download meet error: {e}")
             return False
 
-    def download_video(self, number, url):
-        if self.semaphore:
-            self.semaphore.acquire()
-        trt_times = 10
-        res_content = None
-        while trt_times > 0:
+    def download_video(self, number):
+        if self.pool:
+            self.metrics.set("queue_depth", len(self.pool))
+        numbers = self.segment_jobs.pop(number, None) or [number]
+        pending = list(numbers)
+        try:
+            segments = {number: self.start_segment(number) for number in numbers}
+            # a variant switch may have replaced segments of the job after it was queued, they are grouped again
+            for run in self.coalesce_segments(numbers):
+                run_segments = [segments[number] for number in run]
+                start_time = time.time()
+                contents, decrypt_time = self.fetch_segments(run_segments, run_segments[0]["url"], self.retry_policy)
+                self.record_segment_metrics(start_time, decrypt_time, contents)
+                for number, segment, content in zip(run, run_segments, contents or [None] * len(run)):
+                    self.save_video(number, segment["url"], content)
+                    pending.remove(number)
+        except Exception as e:
+            self.fail_segments(pending, e)
+
+    def fail_segments(self, numbers, error):
+        # an unexpected error (e.g. a segment file that can't be written) fails the segments of the job that aren't
+        # saved yet, so they go through the recovery pass and on_failure like any other failed segment
+        self.logger.error(f"download segments {numbers} meets error: {error!r}")
+        with self.segment_lock:
+            for number in numbers:
+                self.download_failed_dict[number] = self.to_download_url[number]
+
+    def fetch_segments(self, segments, url, retry_policy):
+        # one request for a segment or a run of adjacent byte ranges of url, returns the (decrypted) content of
+        # every segment, None if all attempts failed, and the time spent decrypting
+        fetch = SegmentFetch(segments, self.get_decryptor, retry_policy)
+        contents = None
+        retry_after = None
+        is_fatal = False
+        for i in range(retry_policy.retry_times):
+            if i:
+                self.metrics.inc("retries_total")
+                retry_policy.wait(i - 1, retry_after)
+                retry_after = None
+            headers = fetch.get_headers(self.get_segment_headers())
+            with request_slot(self.concurrency) as slot:
+                request_time = time.time()
+                status = "error"
+                try:
+                    with self.http.stream(url, headers=headers, timeout=10) as res:
+                        status = res.status_code
+                        slot["latency"] = res.elapsed.total_seconds()
+                        slot["throttled"] = is_throttled(res.status_code)
+                        self.metrics.observe("ttfb_seconds", slot["latency"])
+                        if fetch.start_response(res.status_code, headers):
+                            for data in res.iter_content(chunk_size=SEGMENT_CHUNK_SIZE):
+                                data = fetch.clip(data)
+                                limit_rate(self.rate_buckets, len(data))
+                                if self.concurrency:
+                                    self.concurrency.add_bytes(len(data))
+                                if fetch.feed(data):
+                                    break
+                            contents = fetch.finish()
+                            break
+                        self.logger.warning(f"download failed, status code: {res.status_code}, url:{url}")
+                        if not retry_policy.is_retryable(res.status_code):
+                            retry_policy.record_fatal()
+                            is_fatal = True
+                            break
+                        retry_after = res.headers.get("Retry-After")
+                except Exception as e:
+                    slot["throttled"] = is_throttled(error=e)
+                    self.logger.error(f"download failed, will try again: url:{url} ,error:{e}")
+                finally:
+                    self.metrics.observe("request_seconds", time.time() - request_time, status=status)
+        if contents is None and not is_fatal:
+            retry_policy.record_exhausted()
+        return contents, fetch.decrypt_time
+
+    def record_segment_metrics(self, start_time, decrypt_time, contents):
+        spent_time = time.time() - start_time
+        worker = threading.current_thread().name
+        self.metrics.observe("segment_seconds", spent_time, success=contents is not None)
+        if contents is not None:
+            size = sum(len(content) for content in contents)
+            self.metrics.inc("bytes_total", size, worker=worker)
+            self.metrics.observe("worker_bytes_per_second", size / max(spent_time, 0.001), worker=worker)
+        if decrypt_time:
+            self.metrics.observe("decrypt_seconds", decrypt_time)
+
+    async def acquire_slot_async(self, url):
+        # the controller and the http client's per_host_limit / max_connections slots block threads, the event loop
+        # polls them instead, so a batch keeps one connection budget whatever the engine of its items
+        while self.concurrency and not self.concurrency.try_acquire():
+            await asyncio.sleep(0.05)
+        await self.acquire_http_slot_async(url)
+
+    async def acquire_http_slot_async(self, url):
+        while not self.http.try_acquire(url):
+            await asyncio.sleep(0.05)
+
+    async def download_video_async(self, session, numbers):
+        pending = list(numbers)
+        try:
+            segments = {number: self.start_segment(number) for number in numbers}
+            for run in self.coalesce_segments(numbers):
+                run_segments = [segments[number] for number in run]
+                for segment in run_segments:
+                    if segment["map"]:
+                        await self.get_init_section_async(session, segment["map"])
+                start_time = time.time()
+                contents, decrypt_time = await self.fetch_segments_async(session, run_segments)
+                self.record_segment_metrics(start_time, decrypt_time, contents)
+                for number, segment, content in zip(run, run_segments, contents or [None] * len(run)):
+                    # file writes, spill writes and the ffmpeg pipe may block, the loop keeps serving the requests
+                    await asyncio.to_thread(self.save_video, number, segment["url"], content)
+                    pending.remove(number)
+        except Exception as e:
+            self.fail_segments(pending, e)
+
+    async def fetch_segments_async(self, session, segments):
+        # fetch_segments on the event loop
+        url = segments[0]["url"]
+        fetch = SegmentFetch(segments, self.get_decryptor, self.retry_policy)
+        contents = None
+        retry_after = None
+        is_fatal = False
+        for i in range(self.retry_policy.retry_times):
+            if i:
+                self.metrics.inc("retries_total")
+                await asyncio.sleep(self.retry_policy.get_delay(i - 1, retry_after))
+                retry_after = None
+            headers = fetch.get_headers(self.get_segment_headers())
+            await self.acquire_slot_async(url)
+            request_time = time.time()
+            status = "error"
+            latency = None
+            throttled = False
             try:
-                res = requests.get(url, timeout=10, stream=True)
-                if res.status_code == 200:
-                    res_content = res.content
-                    break
+                async with session.get(url, headers=headers) as res:
+                    status = res.status
+                    latency = time.time() - request_time
+                    throttled = is_throttled(res.status)
+                    self.metrics.observe("ttfb_seconds", latency)
+                    if fetch.start_response(res.status, headers):
+                        async for data in res.content.iter_chunked(SEGMENT_CHUNK_SIZE):
+                            data = fetch.clip(data)
+                            await limit_rate_async(self.rate_buckets, len(data))
+                            if self.concurrency:
+                                self.concurrency.add_bytes(len(data))
+                            if fetch.feed(data):
+                                break
+                        contents = fetch.finish()
+                        break
+                    self.logger.warning(f"download failed, status code: {res.status}, url:{url}")
+                    if not self.retry_policy.is_retryable(res.status):
+                        self.retry_policy.record_fatal()
+                        is_fatal = True
+                        break
+                    retry_after = res.headers.get("Retry-After")
+            except Exception as e:
+                throttled = is_throttled(error=e)
+                self.logger.error(f"download failed, will try again: url:{url} ,error:{e!r}")
+            finally:
+                self.metrics.observe("request_seconds", time.time() - request_time, status=status)
+                self.http.release(url)
+                if self.concurrency:
+                    self.concurrency.release(latency, throttled)
+        if contents is None and not is_fatal:
+            self.retry_policy.record_exhausted()
+        return contents, fetch.decrypt_time
+
+    async def download_worker_async(self, session, jobs):
+        while not jobs.empty():
+            self.metrics.set("queue_depth", jobs.qsize())
+            await self.download_video_async(session, jobs.get_nowait())
+
+    async def download_all_async(self, to_download):
+        # hundreds of keep-alive requests in flight on one thread, sp_count bounds the concurrency
+        jobs = asyncio.Queue()
+        self.init_tasks = dict()
+        for run in self.coalesce_segments(to_download):
+            self.coalesced_count += len(run) - 1
+            jobs.put_nowait(run)
+        connector = aiohttp.TCPConnector(limit=self.sp_count, limit_per_host=self.per_host_limit or 0)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=10)
+        # aiohttp keeps its own connections, its requests and handshakes are counted in the http client's stats
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            self.http.count_request()
+
+        async def on_connection_create_end(session, context, params):
+            self.http.count_connection()
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        self.logger.info("asyncio engine: aiohttp opens its own connections, requests wait for the http client's slots")
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=[trace_config]) as session:
+            workers = [self.download_worker_async(session, jobs) for _ in range(min(self.sp_count, jobs.qsize()))]
+            await asyncio.gather(*workers)
+
+    def coalesce_segments(self, numbers):
+        # runs of consecutive segments whose byte ranges follow each other in the same resource, each run is one
+        # request of at most coalesce_size bytes
+        runs = list()
+        run_size = 0
+        for number in numbers:
+            segment = self.segments[number]
+            byterange = segment["byterange"]
+            if runs and byterange and self.coalesce_size and runs[-1][-1] + 1 == number:
+                previous = self.segments[number - 1]
+                if (previous["byterange"] and previous["url"] == segment["url"]
+                        and sum(previous["byterange"]) == byterange[1]
+                        and run_size + byterange[0] <= self.coalesce_size):
+                    runs[-1].append(number)
+                    run_size += byterange[0]
+                    continue
+            runs.append([number])
+            run_size = byterange[0] if byterange else 0
+        return runs
+
+    def get_init_section(self, segment_map):
+        # the EXT-X-MAP media initialization section, requested once and shared by all segments it applies to
+        cache_key = (segment_map["url"], segment_map["byterange"])
+        with self.init_lock:
+            if cache_key in self.init_cache:
+                return self.init_cache[cache_key]
+            res = self.http.get(segment_map["url"], headers=self.get_init_headers(segment_map), timeout=10)
+            data = self.read_init_section(segment_map, res.status_code, res.content)
+            self.init_cache[cache_key] = data
+            return data
+
+    async def get_init_section_async(self, session, segment_map):
+        # the same through the aiohttp session, one request per map however many segments wait for it, the thread
+        # that saves the segment then finds it in init_cache
+        cache_key = (segment_map["url"], segment_map["byterange"])
+        if cache_key in self.init_cache:
+            return
+        task = self.init_tasks.get(cache_key)
+        if task is None:
+            task = self.init_tasks[cache_key] = asyncio.ensure_future(self.fetch_init_section_async(session,
+                                                                                                      segment_map))
+        try:
+            await task
+        except Exception:
+            # the next segment of this map tries again
+            if self.init_tasks.get(cache_key) is task:
+                del self.init_tasks[cache_key]
+            raise
+
+    async def fetch_init_section_async(self, session, segment_map):
+        url = segment_map["url"]
+        await self.acquire_http_slot_async(url)
+        try:
+            async with session.get(url, headers=self.get_init_headers(segment_map)) as res:
+                status, data = res.status, await res.read()
+        finally:
+            self.http.release(url)
+        data = self.read_init_section(segment_map, status, data)
+        with self.init_lock:
+            self.init_cache[(url, segment_map["byterange"])] = data
+
+    def get_init_headers(self, segment_map):
+        headers = self.get_headers()
+        byterange = segment_map["byterange"]
+        if byterange:
+            headers["Range"] = f"bytes={byterange[1]}-{byterange[1] + byterange[0] - 1}"
+        return headers
+
+    def read_init_section(self, segment_map, status_code, data):
+        if status_code not in (200, 206):
+            raise Exception(f"get init section error, status code: {status_code}, url: {segment_map['url']}")
+        byterange = segment_map["byterange"]
+        if byterange and status_code == 200:
+            data = data[byterange[1]:byterange[1] + byterange[0]]
+        segment_key = segment_map["key"]
+        if segment_key:
+            # the IV attribute is required for an encrypted init section (RFC 8216 4.3.2.5)
+            decryptor = SegmentDecryptor(self.get_key(segment_key["uri"]), get_key_iv(segment_key["iv"], 0))
+            data = decryptor.update(data) + decryptor.finish()
+        self.logger.info(f"init section: {len(data)} Bytes, url: {segment_map['url']}")
+        return data
+
+    def add_init_section(self, number, res_content):
+        # the init section goes in front of the first segment it applies to, the merged output starts with it
+        with self.segment_lock:
+            segment_map = self.segments[number]["map"]
+            previous_map = self.segments[number - 1]["map"] if number else None
+        if not segment_map or segment_map == previous_map:
+            return res_content
+        return self.get_init_section(segment_map) + res_content
+
+    def save_video(self, number, url, res_content):
+        if res_content:
+            try:
+                res_content = self.add_init_section(number, res_content)
             except Exception as e:
-                self.logger.error(f"download failed, will try again: url:{url} ,error:{e}")
+                self.logger.error(f"get init section failed, number:{number}, error: {e}")
                 res_content = None
-            trt_times -= 1
-            time.sleep(1)
         if res_content:
-            if self.key_str:
-                res_content = decode_video(res_content, self.key_str, self.key_iv)
-            path = os.path.join(self.save_dir, self.video_folder, "{0:0>8}".format(number) + str(self.file_type))
-            with open(path, "wb+") as f:
-                f.write(res_content)
-                # self.logger.info(f"download video {path} (total: {len(self.to_download_url)}) success, url: {url}")
+            path = self.get_segment_path(number)
+            if self.keep_segments or not self.assembler:
+                with open(path, "wb+") as f:
+                    f.write(res_content)
+                    # self.logger.info(f"download video {path} (total: {len(self.to_download_url)}) success, url: {url}")
+                if self.journal:
+                    self.journal.add(number, url, len(res_content), hashlib.md5(res_content).hexdigest())
+                    self.journal.maybe_flush()
+            if self.assembler:
+                merge_start = time.perf_counter()
+                self.assembler.push(number, res_content, path if self.keep_segments else None)
+                self.metrics.observe("merge_seconds", time.perf_counter() - merge_start)
+            with self.segment_lock:
+                self.downloaded_size += len(res_content)
             if self.tqdm:
+                if self.concurrency:
+                    self.tqdm.set_postfix(concurrency=self.concurrency.level, refresh=False)
                 self.tqdm.update(1)
+            self.check_switch_down(len(res_content))
+            self.release_segment(number)
         else:
             self.logger.warning(f"download video failed, number:{number},url:{url}")
             self.download_failed_dict.update({number: url})
-        if self.semaphore:
-            self.semaphore.release()
 
-    def merge_videos(self):
-        if os.name != "nt":
-            self.logger.warning(f"current system {os.name} is not Windows, can't merge.")
+    def release_segment(self, number):
+        # a live capture may run for hours, a saved segment only keeps the map the next one compares its own with
+        if not self.live:
             return
+        with self.segment_lock:
+            self.segments[number] = {"map": self.segments[number]["map"]}
+            self.to_download_url[number] = None
+            self.started_segments.discard(number)
+
+    def get_merge_output(self, merge_path):
+        # ffmpeg remuxes whatever is written into its stdin, without ffmpeg the segments are simply concatenated
+        if self.ffmpeg_path:
+            self.logger.info(f"use ffmpeg to merge, ffmpeg path: {self.ffmpeg_path}")
+            input_format = "mpegts" if self.file_type == ".ts" else None
+            return FFmpegPipe(self.ffmpeg_path, merge_path, self.logger, input_format)
+        self.logger.warning(f"ffmpeg not exist, will merge by python")
+        return open(merge_path, "wb")
+
+    def close_merge_output(self, output):
+        return_code = output.close()
+        if return_code:
+            self.logger.error(f"ffmpeg exit status: {return_code}, stderr: {list(output.stderr_lines)}")
+            return False
+        return True
+
+    def merge_videos(self):
+        # returns whether the merged file was written
         self.logger.info("start merge")
         path = self.save_dir
         if os.path.isabs(path):
@@ -208,70 +1207,216 @@ class M3U8Downloader:
             path = self.current_file_path + os.sep + os.path.basename(self.save_dir) + os.sep + self.video_folder
         if not os.path.exists(path):
             self.logger.warning(f"merge_videos canceled, the path({path}) is not exist")
-            return
-        self.logger.info(f"ffmpeg path: {self.ffmpeg_path}")
+            return False
         all_ts_files = os.listdir(path)
         all_ts_files = [ts for ts in all_ts_files if ts.startswith("0") and ts.endswith(self.file_type)]
         if not all_ts_files:
             self.logger.warning(f"there is no {self.file_type} file need to merge")
-            return
+            return False
         all_ts_files.sort(key=lambda x: x)
-        self.logger.info(f"ffmpeg path: {self.ffmpeg_path}")
-        if self.ffmpeg_path and os.path.exists(self.ffmpeg_path):
-            self.logger.info(f"use ffmpeg to merge")
-            with open(path + os.sep + "merge_file_list.txt", "w") as f:
-                for file in all_ts_files:
-                    f.write("file " + "'" + path + os.sep + file + "'" + "\n")
-            cmd = "{} -f concat -safe 0 -i {} -c copy {}".format(
-                self.ffmpeg_path, path + os.sep + 'merge_file_list.txt', path + os.sep + self.merge_name)
-            self.logger.info(f"merge cmd: {cmd}")
-            res = os.system(cmd)
-            if res:
-                self.logger.error("merge failed")
-            else:
-                self.logger.info("merge success")
-        else:
-            self.logger.warning(f"ffmpeg not exist, will merge by python")
+        try:
+            output = self.get_merge_output(path + os.sep + self.merge_name)
             try:
-                with open(path + os.sep + self.merge_name, "wb+") as f:
-                    for ts_file in all_ts_files:
-                        with open(path + os.sep + ts_file, "rb+") as t:
-                            f.write(t.read())
-            except Exception as e:
-                self.logger.error(f"merge failed: {e}")
-            else:
-                self.logger.info("merge success")
+                for ts_file in all_ts_files:
+                    with open(path + os.sep + ts_file, "rb") as t:
+                        shutil.copyfileobj(t, output, 1024 * 1024)
+            finally:
+                is_success = self.close_merge_output(output)
+        except Exception as e:
+            self.logger.error(f"merge failed: {e}")
+            return False
+        if is_success:
+            self.logger.info("merge success")
+        else:
+            self.logger.error("merge failed")
+        return is_success
+
+    def get_part_path(self):
+        return os.path.join(self.save_dir, self.video_folder, f"part_{self.merge_name}")
+
+    def start_stream_merge(self):
+        if not self.stream_merge:
+            return
+        folder = os.path.join(self.save_dir, self.video_folder)
+        output = self.get_merge_output(self.get_part_path())
+        self.assembler = SegmentAssembler(output, folder, self.file_type, self.reorder_buffer)
+        self.logger.info(f"stream merge to {output.name}, reorder_buffer: {self.reorder_buffer}")
+
+    def finish_stream_merge(self):
+        # returns whether the merged file was written
+        leftovers = self.assembler.finish()
+        is_success = self.close_merge_output(self.assembler.output)
+        part_path = self.get_part_path()
+        merge_path = os.path.join(self.save_dir, self.video_folder, self.merge_name)
+        if self.get_missing_segments() or leftovers:
+            self.logger.warning(f"stream merge stopped at segment {self.assembler.next_index}, "
+                                f"{len(leftovers)} later segments kept as files, partial file: {part_path}")
+            return False
+        if self.assembler.error or not is_success:
+            self.logger.error(f"merge failed: {self.assembler.error}")
+            return False
+        os.replace(part_path, merge_path)
+        tail_time = time.time() - (self.assembler.last_write_time or time.time())
+        self.logger.info("merge success, {} segments, {} Bytes, spilled: {}, skipped: {}, merged file ready {:.2f}s "
+                         "after the last write: {}".format(self.assembler.written_count, self.assembler.written_size,
+                                                           self.assembler.spill_count, self.assembler.skipped_count,
+                                                           tail_time, merge_path))
+        return True
+
+    def get_mirror_urls(self, url):
+        # the same segment on the mirrors: the part after base_url, or else the path of the url, on every mirror
+        if url.startswith(self.base_url):
+            rest = url[len(self.base_url):].lstrip("/")
+        else:
+            parts = urlsplit(url)
+            rest = parts.path.lstrip("/") + (f"?{parts.query}" if parts.query else "")
+        return [f"{mirror.rstrip('/')}/{rest}" for mirror in self.mirrors]
+
+    def recover_video(self, number):
+        try:
+            segment = self.start_segment(number)
+            start_time = time.time()
+            contents, decrypt_time = None, 0
+            for url in [segment["url"]] + self.get_mirror_urls(segment["url"]):
+                contents, decrypt_time = self.fetch_segments([segment], url, self.recovery_policy)
+                if contents is not None:
+                    if url != segment["url"]:
+                        self.logger.info(f"segment {number} recovered from mirror: {url}")
+                    break
+            self.record_segment_metrics(start_time, decrypt_time, contents)
+            self.save_video(number, segment["url"], contents[0] if contents else None)
+        except Exception as e:
+            self.fail_segments([number], e)
+
+    def recover_segments(self):
+        # second pass over the failed segments once the main pass is done, a flaky segment often comes back later
+        if not self.download_failed_dict or not self.recovery_count:
+            return
+        failed = sorted(self.download_failed_dict)
+        self.download_failed_dict = dict()
+        self.logger.info(f"recover {len(failed)} failed segments with {self.recovery_count} threads, "
+                         f"mirrors: {len(self.mirrors)}")
+        pool = WorkerPool(min(self.recovery_count, len(failed)), self.recover_video, name="M3U8Recovery",
+                          logger=self.logger).start()
+        for number in failed:
+            pool.submit(number, priority=number)
+        pool.close()
+        pool.join()
+        recovered_count = len(failed) - len(self.download_failed_dict)
+        self.metrics.inc("recovered_segments_total", recovered_count)
+        self.logger.info(f"recovered {recovered_count} of {len(failed)} failed segments")
+
+    def get_fill_source(self, number):
+        # the closest earlier segment on disk stands in for a missing one, a later one if there is none
+        for other in list(range(number - 1, -1, -1)) + list(range(number + 1, len(self.segments))):
+            if other not in self.download_failed_dict and os.path.isfile(self.get_segment_path(other)):
+                return self.get_segment_path(other)
+        return None
+
+    def patch_segments(self):
+        # on_failure "gap" merges without the missing segments, "fill" repeats a neighbouring segment in their place
+        for number in sorted(self.download_failed_dict):
+            source = self.get_fill_source(number) if self.on_failure == "fill" else None
+            if self.on_failure == "fill" and not source:
+                self.logger.warning(f"no segment file on disk to fill segment {number} with, merged with a gap")
+            if source and self.assembler:
+                self.assembler.push(number, path=source)
+            elif source:
+                shutil.copyfile(source, self.get_segment_path(number))
+            elif self.assembler:
+                self.assembler.skip(number)
+            self.patched_segments[number] = source
+        self.metrics.inc("patched_segments_total", len(self.patched_segments))
+
+    def get_missing_segments(self):
+        return [number for number in self.download_failed_dict if number not in self.patched_segments]
+
+    def get_segment_path(self, number):
+        return os.path.join(self.save_dir, self.video_folder, "{0:0>8}".format(number) + str(self.file_type))
+
+    def is_segment_complete(self, number, item):
+        # a segment of the earlier run counts if it is the same url and the file is neither missing nor truncated
+        path = self.get_segment_path(number)
+        if not item or item["url"] != self.segments[number]["url"] or not os.path.isfile(path):
+            return False
+        if os.path.getsize(path) != item["size"]:
+            return False
+        if self.resume == "verify":
+            md5 = hashlib.md5()
+            with open(path, "rb") as f:
+                for data in iter(lambda: f.read(1024 * 1024), b""):
+                    md5.update(data)
+            return md5.hexdigest() == item["md5"]
+        return True
+
+    def load_segment_journal(self):
+        if not self.resume:
+            return
+        journal_path = os.path.join(self.save_dir, self.video_folder, SEGMENT_JOURNAL_NAME)
+        self.journal = SegmentJournal(journal_path, {"m3u8_url": self.m3u8_url})
+        if self.journal.load():
+            self.logger.info(f"resume from {journal_path}")
+        else:
+            self.logger.info(f"no segments to resume, journal: {journal_path}")
+
+    def get_resumed_segments(self, numbers):
+        # the segments among numbers that are complete on disk from an earlier run
+        if not self.journal:
+            return list()
+        resumed = list()
+        for number in numbers:
+            item = self.journal.get(number)
+            if self.is_segment_complete(number, item):
+                self.resumed_segments[number] = item["size"]
+                self.resumed_size += item["size"]
+                resumed.append(number)
+        # resumed segments keep their variant, like segments that have started
+        with self.segment_lock:
+            self.started_segments.update(resumed)
+        self.metrics.inc("resumed_segments_total", len(resumed))
+        return resumed
+
+    def push_resumed_segments(self, resumed):
+        if self.tqdm and resumed:
+            self.tqdm.update(len(resumed))
+        if self.assembler:
+            for number in resumed:
+                self.assembler.push(number, path=self.get_segment_path(number))
+
+    def submit_segments(self, pool, numbers):
+        resumed = self.get_resumed_segments(numbers)
+        for run in self.coalesce_segments([idx for idx in numbers if idx not in self.resumed_segments]):
+            if len(run) > 1:
+                self.segment_jobs[run[0]] = run
+                self.coalesced_count += len(run) - 1
+            pool.submit(run[0], priority=run[0])
+        # the files of the earlier run are merged while the missing segments download
+        self.push_resumed_segments(resumed)
 
     def mkdir(self):
-        if not os.path.exists(self.save_dir):
-            os.mkdir(self.save_dir)
+        os.makedirs(self.save_dir, exist_ok=True)
         self.logger.info(f"make save_dir({self.save_dir}) success.")
         video_folder = os.path.join(self.save_dir, self.video_folder)
-        if not os.path.exists(video_folder):
-            os.mkdir(video_folder)
+        os.makedirs(video_folder, exist_ok=True)
         self.logger.info(f"make video_folder({video_folder}) success.")
 
+    def get_url_base(self):
+        if self.url_compat:
+            return self.base_url
+        if self.auto_base_url and self.m3u8_url.startswith("http"):
+            return self.playlist_url or self.m3u8_url
+        # a base_url that was given (or found for a local playlist) is the directory of the segments
+        return self.base_url if self.base_url.endswith("/") else f"{self.base_url}/"
+
+    def get_url_resolver(self):
+        # built again when the base changes, e.g. after a variant switch
+        base = self.get_url_base()
+        if not self.url_resolver or self.url_resolver.base_url != base:
+            self.url_resolver = UrlResolver(base, compat=self.url_compat)
+        return self.url_resolver
+
     def normalize_url(self, raw_url):
-        raw_url = raw_url.strip()
-        if raw_url.startswith("#"):
-            return
-        if raw_url and raw_url.startswith("http") and any(
-                [raw_url.split("?")[0].endswith(".ts"), raw_url.split("?")[0].endswith(".key")]):
-            return raw_url
-        if raw_url and not str(raw_url).startswith("http"):
-            last_find_str = ""
-            for i in range(1, len(raw_url) + 1):
-                start_str = raw_url[:i]
-                if self.base_url.rfind(start_str) == -1:
-                    break
-                else:
-                    last_find_str = start_str
-            sep = "" if self.base_url.endswith("/") or raw_url.startswith("/") else "/"
-            if len(last_find_str) > 2 and self.base_url.endswith(last_find_str):
-                raw_url = f"{self.base_url}{sep}{raw_url.replace(last_find_str, '')}"
-            else:
-                raw_url = f"{self.base_url}{sep}{raw_url}"
-        return raw_url
+        return self.get_url_resolver().resolve(raw_url)
 
     def normalize_m3u8_file(self, path):
         if not os.path.exists(path):
@@ -288,7 +1433,11 @@ class M3U8Downloader:
     def normalize_base_url(self):
         if self.base_url and self.base_url.startswith('http'):
             return
-        base_url = M3U8Loader.load(self.m3u8_url).base_url
+        if self.m3u8_url.startswith("http") and not self.url_compat:
+            # segment uris are resolved against the playlist url, base_url is only needed for the mirrors
+            self.base_url = self.m3u8_url.split("?")[0].rsplit("/", maxsplit=1)[0]
+            return
+        base_url = M3U8Loader.detect_base_url(self.m3u8_url, http_client=self.http)
         if base_url:
             self.base_url = base_url
         else:
@@ -299,28 +1448,85 @@ class M3U8Downloader:
         self.get_m3u8_info()
         if not self.to_download_url:
             self.logger.warning("there is no url to download, self.to_download_url is empty, please check url")
-            return
-        self.logger.info(f"self.key_str: {self.key_str}")
-        self.logger.info(f"self.key_method: {self.key_method}")
+            return False
         if not self.test_download(self.to_download_url[0]):
             self.logger.warning(f"test download failed, pls check whether the url is valid ({self.to_download_url[0]})")
-            return
+            if self.playlist:
+                self.playlist.close()
+            return False
         self.mkdir()
-        threads = [Thread(target=self.download_video, args=(idx, url)) for idx, url in enumerate(self.to_download_url)]
-        for t in threads:
-            t.start()
-        for t in threads:
-            t.join()
+        self.start_stream_merge()
+        self.load_segment_journal()
+        if self.engine == "asyncio" and self.live:
+            self.logger.warning("live mode downloads with the thread engine")
+        if self.engine == "asyncio" and not self.live:
+            # the event loop gets the whole playlist at once
+            while self.segment_batches:
+                self.read_playlist_batch()
+            resumed = self.get_resumed_segments(range(len(self.segments)))
+            self.push_resumed_segments(resumed)
+            to_download = [idx for idx in range(len(self.segments)) if idx not in self.resumed_segments]
+            if to_download:
+                asyncio.run(self.download_all_async(to_download))
+        else:
+            # a fixed number of threads, segments from the head of the playlist go first so playback can start early
+            worker_count = self.sp_count if self.live or self.segment_batches else min(self.sp_count,
+                                                                                        len(self.segments))
+            pool = WorkerPool(worker_count, self.download_video, name="M3U8Downloader", logger=self.logger).start()
+            self.pool = pool
+            self.submit_segments(pool, range(len(self.segments)))
+            # the rest of a long playlist is read while the first segments download
+            while self.segment_batches:
+                self.submit_segments(pool, self.read_playlist_batch())
+            if self.live:
+                self.download_live(pool)
+            pool.close()
+            pool.join()
+        if self.playlist_error:
+            raise Exception(f"reading the playlist failed after {len(self.segments)} segments: {self.playlist_error}")
+        if self.coalesced_count:
+            self.logger.info(f"byte ranges coalesced: {self.coalesced_count} requests saved")
+            self.metrics.set("coalesced_segments", self.coalesced_count)
+        if self.resumed_segments:
+            self.logger.info(f"resumed {len(self.resumed_segments)} of {len(self.segments)} segments "
+                             f"({self.resumed_size} Bytes)")
+        self.recover_segments()
+        if self.download_failed_dict and self.on_failure != "fail":
+            self.patch_segments()
+        if self.journal:
+            self.journal.flush()
         self.logger.info(f"all download finish, spent time: {time.time() - start_time:.2f} second")
         self.logger.info(f"total video count: {len(self.to_download_url)}")
         self.logger.info(f"download_failed_dict: {self.download_failed_dict}")
-        if self.download_failed_dict:
-            self.logger.warning(f"{len(self.download_failed_dict)} video file download failed.")
-            raise Exception(f"{len(self.download_failed_dict)} video file download failed.")
-        if self.ffmpeg_path:
-            self.merge_videos()
+        if self.concurrency:
+            self.logger.info(format_concurrency_stats(self.concurrency.get_stats()))
+        for name, policy in (("retries", self.retry_policy), ("recovery retries", self.recovery_policy)):
+            self.logger.info(format_retry_stats(policy.get_stats(), name, "segments"))
+        self.logger.info(format_http_stats(self.http.get_stats()))
+        if self.own_http:
+            self.http.close()
+        merge_time = time.time()
+        missing = self.get_missing_segments()
+        is_merged = False
+        if self.assembler:
+            is_merged = self.finish_stream_merge()
+        elif not missing:
+            is_merged = self.merge_videos()
+        # with stream_merge only the tail of the merge is left at this point
+        self.metrics.set("merge_finish_seconds", time.time() - merge_time)
+        self.metrics.set("download_seconds", time.time() - start_time)
+        self.metrics.export_summary()
+        if missing:
+            self.logger.warning(f"{len(missing)} video file download failed.")
+            raise Exception(f"{len(missing)} video file download failed.")
+        if self.patched_segments:
+            self.logger.warning(f"merged with {len(self.patched_segments)} failed segments patched "
+                                f"(on_failure: {self.on_failure}): {sorted(self.patched_segments)}")
         if self.tqdm:
             self.tqdm.close()
+        if not is_merged:
+            self.logger.error(f"the merged file was not produced: {os.path.join(self.save_dir, self.video_folder)}")
+        return is_merged
 
 
 if __name__ == '__main__':
@@ -345,6 +1551,7 @@ if __name__ == '__main__':
         "merge_name": "",
         "sp_count": 2,
         "if_tqdm": True,
+        "engine": "thread",
     }
     # if os.path.isfile(params_dict["m3u8_url"]) and not params_dict["base_url"]:
     #     raise Exception("the m3u8 file is a local file but miss base_url")
@@ -1,4 +1,5 @@
 import os.path
+import shutil
 
 import PySimpleGUI as sg
 
@@ -104,7 +105,7 @@ def get_layout():
             sg.Radio(text="否", group_id="if_random_ug", size=(5, 1), default=False, key="key_if_random_ug_radio2"),
         ],
         [
-            sg.Text("同时下载线程数", size=text_and_button_size, justification="center", border_width=3, ),
+            sg.Text("最大下载线程数", size=text_and_button_size, justification="center", border_width=3, ),
             sg.Combo(values=[0, 1, 2, 5, 10, 100, 1000], default_value=2, size=text_and_button_size, key="key_sp_count")
         ],
     ]
@@ -172,7 +173,7 @@ def check_params(values: dict):
     if save_dir and not os.path.exists(save_dir):
         sg.popup("请确认文件保存路径是否存在", title="警告")
         return False
-    if not ffmpeg_path and not os.path.exists("./utils/ffmpeg.exe"):
+    if not ffmpeg_path and not os.path.exists("./utils/ffmpeg.exe") and not shutil.which("ffmpeg"):
         res = sg.popup_yes_no("未检测到ffmpeg程序，程序将尝试以文件流的方式合并视频，是否继续？", title="警告")
         if res == "No":
             return False
@@ -202,6 +203,7 @@ def check_params(values: dict):
         "ffmpeg_path": ffmpeg_path if ffmpeg_path else "./utils/ffmpeg.exe",
         "merge_name": "",
         "sp_count": int(sp_count),
+        "adaptive": True,
         "if_tqdm": False,
     }
 
@@ -217,7 +219,7 @@ def run():
 4.完整版程序自带ffmpeg程序，一般无需指定路径；
 5.若要自定义请求头请以JSON的形式表示键值；
 6.建议设置随机代理减少触发反爬机制的概率；
-7.有些服务器会限制同时下载个数，可适当调小线程数（0表示不限制）；
+7.有些服务器会限制同时下载个数，可适当调小线程数（0表示使用默认值32）；
 
 该程序完全免费且开源，请勿用于商业用途
 GitHub：https://github.com/panmeibing/python_downloader
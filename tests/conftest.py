@@ -0,0 +1,101 @@
+import os
+import socket
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# the modules live in the repository root, next to this folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FileServer:
+    # serves the files of root on 127.0.0.1, with Range support unless ranges=False (then every GET is a 200);
+    # HEAD is unsupported (501) unless head_headers is given, those headers override the ones a GET would have,
+    # content_length=False sends bodies without a length and closes the connection after them
+    def __init__(self, root, ranges=True, head_headers=None, content_length=True):
+        self.root = str(root)
+        self.ranges = ranges
+        self.head_headers = head_headers
+        self.content_length = content_length
+        self.lock = threading.Lock()
+        self.requests = list()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # headers and body are two writes, without this every keep-alive request waits for a delayed ACK
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def read_file(self):
+                path = os.path.join(server.root, self.path.split("?")[0].lstrip("/"))
+                with server.lock:
+                    server.requests.append((self.path, self.headers.get("Range")))
+                if not os.path.isfile(path):
+                    self.send_error(404)
+                    return None
+                with open(path, "rb") as f:
+                    return f.read()
+
+            def do_HEAD(self):
+                if server.head_headers is None:
+                    self.send_error(501)
+                    return
+                data = self.read_file()
+                if data is None:
+                    return
+                headers = {"Content-Length": str(len(data)), "Accept-Ranges": "bytes" if server.ranges else "none"}
+                headers.update(server.head_headers)
+                self.send_response(200)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+
+            def do_GET(self):
+                data = self.read_file()
+                if data is None:
+                    return
+                status = 200
+                byte_range = self.headers.get("Range")
+                if byte_range and server.ranges:
+                    start, _, end = byte_range.split("=", 1)[1].partition("-")
+                    end = min(int(end), len(data) - 1) if end else len(data) - 1
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+                    data = data[int(start):end + 1]
+                else:
+                    self.send_response(status)
+                if server.content_length:
+                    self.send_header("Content-Length", str(len(data)))
+                else:
+                    self.send_header("Connection", "close")
+                    self.close_connection = True
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.httpd.server_port}/{path}"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def file_server(tmp_path):
+    server = FileServer(tmp_path / "www")
+    os.makedirs(server.root, exist_ok=True)
+    yield server
+    server.close()
@@ -0,0 +1,184 @@
+import base64
+import hashlib
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import FileServer
+from file_downloader import MultiDownloader
+from utils.journal_utils import RangeJournal
+from utils.retry_utils import RetryPolicy
+
+
+def write_file(root, size, name="file.bin"):
+    content = os.urandom(size)
+    with open(os.path.join(root, name), "wb") as f:
+        f.write(content)
+    return content
+
+
+def make_downloader(tmp_path, url, **kwargs):
+    options = dict(save_path=str(tmp_path / "out"), thread_count=4, retry_policy=RetryPolicy(2, base_delay=0))
+    options.update(kwargs)
+    return MultiDownloader(url=url, **options)
+
+
+def read_saved(downloader):
+    with open(os.path.join(downloader.save_path, downloader.file_name), "rb") as f:
+        return f.read()
+
+
+def serve(tmp_path, **kwargs):
+    server = FileServer(tmp_path / "www", **kwargs)
+    os.makedirs(server.root, exist_ok=True)
+    return server
+
+
+def test_head_length_of_zero_is_not_trusted(tmp_path):
+    server = serve(tmp_path, head_headers={"Content-Length": "0"})
+    try:
+        content = write_file(server.root, 3 * 1024 * 1024)
+        downloader = make_downloader(tmp_path, server.url("file.bin"))
+        assert downloader.total_range == 0
+        assert downloader.run()
+        assert downloader.total_range == len(content)
+        assert read_saved(downloader) == content
+    finally:
+        server.close()
+
+
+def test_forced_multi_without_file_size_falls_back_to_single(tmp_path):
+    server = serve(tmp_path, ranges=False, content_length=False)
+    try:
+        content = write_file(server.root, 2 * 1024 * 1024)
+        downloader = make_downloader(tmp_path, server.url("file.bin"), strategy="multi")
+        assert downloader.total_range is None
+        assert downloader.strategy == "single"
+        assert downloader.run()
+        assert read_saved(downloader) == content
+    finally:
+        server.close()
+
+
+def range_requests(server):
+    # Range headers of the page requests, without the probe for the first byte
+    return [byte_range for _, byte_range in server.requests if byte_range and byte_range != "bytes=0-0"]
+
+
+def test_unsupported_head_is_replaced_by_a_probe(tmp_path, file_server):
+    content = write_file(file_server.root, 2 * 1024 * 1024)
+    downloader = make_downloader(tmp_path, file_server.url("file.bin"), page_size=256 * 1024)
+    assert file_server.requests[0] == ("/file.bin", "bytes=0-0")
+    assert (downloader.total_range, downloader.range_support, downloader.strategy) == (len(content), True, "multi")
+    assert downloader.run()
+    assert read_saved(downloader) == content
+    assert len(range_requests(file_server)) >= 8
+
+
+@pytest.mark.parametrize("size, ranges, strategy", [
+    (100 * 1024, True, "small"),
+    (2 * 1024 * 1024, True, "multi"),
+    (2 * 1024 * 1024, False, "single"),
+])
+def test_strategy_follows_size_and_range_support(tmp_path, size, ranges, strategy):
+    server = serve(tmp_path, ranges=ranges, head_headers={})
+    try:
+        content = write_file(server.root, size)
+        downloader = make_downloader(tmp_path, server.url("file.bin"))
+        assert downloader.strategy == strategy
+        assert downloader.run()
+        assert read_saved(downloader) == content
+    finally:
+        server.close()
+
+
+def test_ignored_range_falls_back_to_single(tmp_path):
+    server = serve(tmp_path, ranges=False)
+    try:
+        content = write_file(server.root, 2 * 1024 * 1024)
+        downloader = make_downloader(tmp_path, server.url("file.bin"), strategy="multi")
+        assert downloader.strategy == "multi"
+        assert downloader.run()
+        assert downloader.strategy == "single"
+        assert read_saved(downloader) == content
+        assert not os.path.exists(os.path.join(downloader.save_path, "file.bin.journal"))
+    finally:
+        server.close()
+
+
+def test_resume_fetches_only_the_missing_ranges(tmp_path, file_server):
+    content = write_file(file_server.root, 2 * 1024 * 1024)
+    half = len(content) // 2
+    downloader = make_downloader(tmp_path, file_server.url("file.bin"), page_size=256 * 1024)
+    os.makedirs(downloader.save_path, exist_ok=True)
+    full_path = os.path.join(downloader.save_path, "file.bin")
+    with open(full_path, "wb") as f:
+        f.write(content[:half] + bytes(len(content) - half))
+    journal = RangeJournal(f"{full_path}.journal", {"url": downloader.url, "content_length": len(content),
+                                                    "etag": None, "last_modified": None})
+    journal.add(0, half - 1)
+    journal.flush()
+    assert downloader.run()
+    assert read_saved(downloader) == content
+    assert downloader.downloaded_size == len(content) - half
+    assert all(int(byte_range[6:].split("-")[0]) >= half for byte_range in range_requests(file_server))
+    assert not os.path.exists(f"{full_path}.journal")
+
+
+def test_journal_of_another_file_version_starts_over(tmp_path, file_server):
+    content = write_file(file_server.root, 2 * 1024 * 1024)
+    downloader = make_downloader(tmp_path, file_server.url("file.bin"))
+    os.makedirs(downloader.save_path, exist_ok=True)
+    full_path = os.path.join(downloader.save_path, "file.bin")
+    with open(full_path, "wb") as f:
+        f.write(os.urandom(len(content)))
+    journal = RangeJournal(f"{full_path}.journal", {"url": downloader.url, "content_length": len(content) + 1,
+                                                    "etag": None, "last_modified": None})
+    journal.add(0, len(content) - 1)
+    journal.flush()
+    assert downloader.run()
+    assert read_saved(downloader) == content
+    assert downloader.downloaded_size == len(content)
+
+
+@pytest.mark.parametrize("size", [100 * 1024, 2 * 1024 * 1024])
+def test_expected_digest_is_verified(tmp_path, file_server, size):
+    content = write_file(file_server.root, size)
+    digest = hashlib.sha256(content).hexdigest()
+    downloader = make_downloader(tmp_path, file_server.url("file.bin"), expected_digest=f"sha256:{digest}")
+    assert downloader.run()
+    wrong_digest = hashlib.sha256(content + b"x").hexdigest()
+    downloader = make_downloader(tmp_path, file_server.url("file.bin"), expected_digest=f"sha256:{wrong_digest}")
+    assert not downloader.run()
+    assert not os.path.exists(os.path.join(downloader.save_path, "file.bin.journal"))
+
+
+@pytest.mark.parametrize("is_match", [True, False])
+def test_server_digest_from_head_is_verified(tmp_path, is_match):
+    server = serve(tmp_path, head_headers=dict())
+    try:
+        content = write_file(server.root, 2 * 1024 * 1024)
+        digest = hashlib.sha256(content if is_match else content[1:]).digest()
+        server.head_headers["Digest"] = f"sha-256={base64.b64encode(digest).decode()}"
+        downloader = make_downloader(tmp_path, server.url("file.bin"))
+        assert downloader.digest[2] == "Digest"
+        assert downloader.run() is is_match
+    finally:
+        server.close()
+
+
+def test_check_range_response(tmp_path, file_server):
+    write_file(file_server.root, 2 * 1024 * 1024)
+    downloader = make_downloader(tmp_path, file_server.url("file.bin"))
+    downloader.etag = '"v1"'
+
+    def check(headers, start_pos=1024):
+        return downloader.check_range_response(SimpleNamespace(headers=headers), start_pos)
+
+    assert check({"Content-Range": "bytes 1024-2047/2097152", "ETag": '"v1"'}) == (None, False)
+    assert check({"Content-Range": "bytes 1024-2047/*"}) == (None, False)
+    assert check({"Content-Range": "bytes 0-2047/2097152"})[1] is False
+    assert check({})[1] is False
+    assert check({"Content-Range": "bytes 1024-2047/3000000"}) == ("remote file size changed to 3000000", True)
+    assert check({"Content-Range": "bytes 1024-2047/2097152", "ETag": '"v2"'})[1] is True
@@ -0,0 +1,38 @@
+import os
+import threading
+
+import pytest
+
+from utils.file_utils import RangeWriter
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_threads_write_their_ranges_in_place(tmp_path, use_mmap):
+    content = os.urandom(1024 * 1024)
+    path = str(tmp_path / "file.bin")
+    page_size = len(content) // 8
+
+    def worker(writer, start_pos):
+        # backwards within the page, every write lands at its own offset
+        for offset in reversed(range(start_pos, start_pos + page_size, 4096)):
+            writer.write(offset, content[offset:offset + 4096])
+
+    with RangeWriter(path, len(content), use_mmap=use_mmap) as writer:
+        threads = [threading.Thread(target=worker, args=(writer, i * page_size)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.sync()
+    with open(path, "rb") as f:
+        assert f.read() == content
+
+
+def test_existing_data_is_kept(tmp_path):
+    path = str(tmp_path / "file.bin")
+    with open(path, "wb") as f:
+        f.write(b"a" * 100)
+    with RangeWriter(path, 200) as writer:
+        writer.write(150, b"b" * 50)
+    with open(path, "rb") as f:
+        assert f.read() == b"a" * 100 + bytes(50) + b"b" * 50
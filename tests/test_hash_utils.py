@@ -0,0 +1,48 @@
+import base64
+import hashlib
+import os
+import time
+
+import pytest
+
+from utils.hash_utils import PrefixHasher, get_server_digest, parse_expected_digest
+
+
+def test_prefix_hasher_follows_the_completed_prefix(tmp_path):
+    content = os.urandom(1024 * 1024)
+    path = str(tmp_path / "file.bin")
+    with open(path, "wb") as f:
+        f.write(content[:300 * 1024] + bytes(len(content) - 300 * 1024))
+    ready_size = [100 * 1024]
+    hasher = PrefixHasher(path, "sha256", lambda: ready_size[0], chunk_size=64 * 1024, interval=0.01).start()
+    deadline = time.time() + 5
+    while hasher.hashed_size < ready_size[0] and time.time() < deadline:
+        time.sleep(0.01)
+    assert hasher.hashed_size == ready_size[0]
+    ready_size[0] = 300 * 1024
+    # the rest arrives after the last update of the prefix, finish hashes it
+    with open(path, "r+b") as f:
+        f.seek(300 * 1024)
+        f.write(content[300 * 1024:])
+    digest, tail_size = hasher.finish(len(content))
+    assert digest == hashlib.sha256(content).hexdigest()
+    assert 0 < tail_size <= len(content) - 100 * 1024
+
+
+def test_parse_expected_digest():
+    sha256 = hashlib.sha256(b"x").hexdigest()
+    md5 = hashlib.md5(b"x").hexdigest()
+    assert parse_expected_digest(f"SHA-256:{sha256.upper()}") == ("sha256", sha256)
+    assert parse_expected_digest(md5) == ("md5", md5)
+    with pytest.raises(Exception, match="unsupported digest"):
+        parse_expected_digest(f"sha256:{md5}")
+
+
+def test_get_server_digest():
+    digest = hashlib.sha256(b"x").digest()
+    header = f"sha-256={base64.b64encode(digest).decode()}"
+    assert get_server_digest({"Digest": f"unixsum=1, {header}"}) == ("sha256", digest.hex(), "Digest")
+    md5 = hashlib.md5(b"x").digest()
+    assert get_server_digest({"Content-MD5": base64.b64encode(md5).decode()}) == ("md5", md5.hex(), "Content-MD5")
+    assert get_server_digest({"ETag": f'"{md5.hex()}"'}) == ("md5", md5.hex(), "ETag")
+    assert get_server_digest({"ETag": '"5f3a-2b"'}) is None
@@ -0,0 +1,25 @@
+from utils.http_utils import HttpClient
+
+
+def test_try_acquire_shares_the_slots_of_slot():
+    http = HttpClient(per_host_limit=1, max_connections=2)
+    assert http.try_acquire("http://a/1.ts")
+    # the host is busy, another host still gets one of the connections
+    assert not http.try_acquire("http://a/2.ts")
+    assert http.try_acquire("http://b/1.ts")
+    assert not http.try_acquire("http://c/1.ts")
+    http.release("http://a/1.ts")
+    assert http.try_acquire("http://c/1.ts")
+    http.release("http://b/1.ts")
+    http.release("http://c/1.ts")
+    with http.slot("http://a/1.ts"):
+        assert not http.try_acquire("http://a/2.ts")
+    assert http.try_acquire("http://a/2.ts")
+
+
+def test_requests_of_another_client_are_counted():
+    http = HttpClient()
+    http.count_request()
+    http.count_request()
+    http.count_connection()
+    assert http.get_stats() == {"requests": 2, "connections": 1, "handshakes_saved": 1}
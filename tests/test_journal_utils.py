@@ -0,0 +1,26 @@
+from utils.journal_utils import RangeJournal
+
+
+def test_ranges_are_merged_and_missing_ranges_fill_the_gaps(tmp_path):
+    journal = RangeJournal(str(tmp_path / "file.journal"), {"content_length": 100})
+    for start, end in [(50, 59), (0, 9), (10, 19), (70, 79), (55, 72)]:
+        journal.add(start, end)
+    assert journal.get_ranges() == [[0, 19], [50, 79]]
+    assert journal.completed_size() == 50
+    assert journal.prefix_size() == 20
+    assert journal.missing_ranges(100) == [[20, 49], [80, 99]]
+
+
+def test_journal_loads_only_with_the_same_validators(tmp_path):
+    path = str(tmp_path / "file.journal")
+    journal = RangeJournal(path, {"content_length": 100, "etag": '"v1"'})
+    journal.add(10, 19)
+    journal.flush()
+    other = RangeJournal(path, {"content_length": 100, "etag": '"v2"'})
+    assert not other.load()
+    same = RangeJournal(path, {"content_length": 100, "etag": '"v1"'})
+    assert same.load()
+    assert same.missing_ranges(100) == [[0, 9], [20, 99]]
+    assert same.prefix_size() == 0
+    same.remove()
+    assert not same.load()
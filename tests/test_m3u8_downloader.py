@@ -0,0 +1,212 @@
+import os
+import threading
+import time
+
+import pytest
+
+import m3u8_downloader
+from conftest import FileServer
+from m3u8_downloader import M3U8Downloader
+from utils.retry_utils import RetryPolicy
+
+
+@pytest.fixture(autouse=True)
+def no_ffmpeg(monkeypatch):
+    # the segments below are random bytes, they are concatenated instead of remuxed
+    monkeypatch.setattr(m3u8_downloader, "find_ffmpeg", lambda ffmpeg_path=None: None)
+
+
+def write_playlist(root, count, size=1000, name="index.m3u8"):
+    # a VOD playlist of count segments with random content, returns the content of every segment
+    contents = list()
+    lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:2", "#EXT-X-MEDIA-SEQUENCE:0"]
+    for i in range(count):
+        contents.append(os.urandom(size))
+        with open(os.path.join(root, f"s{i}.ts"), "wb") as f:
+            f.write(contents[-1])
+        lines += ["#EXTINF:2.0,", f"s{i}.ts"]
+    lines.append("#EXT-X-ENDLIST")
+    with open(os.path.join(root, name), "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return contents
+
+
+def make_downloader(tmp_path, url, **kwargs):
+    options = dict(base_url="", save_dir=str(tmp_path / "out"), video_folder="video", headers={}, if_random_ug=True,
+                   merge_name="", ffmpeg_path="", sp_count=4, if_tqdm=False, retry_times=1,
+                   recovery_policy=RetryPolicy(1, base_delay=0))
+    options.update(kwargs)
+    return M3U8Downloader(m3u8_url=url, **options)
+
+
+def read_merged(downloader):
+    with open(os.path.join(downloader.save_dir, downloader.video_folder, downloader.merge_name), "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("engine", ["thread", "asyncio"])
+@pytest.mark.parametrize("stream_merge", [True, False])
+def test_segment_that_cannot_be_saved_fails_the_download(tmp_path, file_server, engine, stream_merge):
+    write_playlist(file_server.root, 10)
+    downloader = make_downloader(tmp_path, file_server.url("index.m3u8"), engine=engine, stream_merge=stream_merge)
+    # a folder in place of the segment file makes the write fail
+    os.makedirs(os.path.join(downloader.save_dir, downloader.video_folder, "00000005.ts"))
+    with pytest.raises(Exception, match="1 video file download failed"):
+        downloader.run()
+    assert list(downloader.download_failed_dict) == [5]
+
+
+def test_segment_that_cannot_be_saved_is_left_out_with_gap(tmp_path, file_server):
+    contents = write_playlist(file_server.root, 10)
+    downloader = make_downloader(tmp_path, file_server.url("index.m3u8"), on_failure="gap")
+    os.makedirs(os.path.join(downloader.save_dir, downloader.video_folder, "00000005.ts"))
+    assert downloader.run()
+    assert read_merged(downloader) == b"".join(contents[:5] + contents[6:])
+
+
+def test_live_capture_queues_every_segment_once(tmp_path, file_server):
+    count, window = 12, 5
+    contents = [os.urandom(500) for _ in range(count)]
+    for i, content in enumerate(contents):
+        with open(os.path.join(file_server.root, f"s{i}.ts"), "wb") as f:
+            f.write(content)
+
+    def write_window(head):
+        lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:1", f"#EXT-X-MEDIA-SEQUENCE:{head - window}"]
+        for i in range(head - window, head):
+            lines += ["#EXTINF:1.0,", f"s{i}.ts"]
+        if head == count:
+            lines.append("#EXT-X-ENDLIST")
+        with open(os.path.join(file_server.root, "live.tmp"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(os.path.join(file_server.root, "live.tmp"), os.path.join(file_server.root, "live.m3u8"))
+
+    def slide():
+        for head in range(window + 1, count + 1):
+            time.sleep(0.25)
+            write_window(head)
+
+    write_window(window)
+    writer = threading.Thread(target=slide)
+    downloader = make_downloader(tmp_path, file_server.url("live.m3u8"), live=True, live_duration=30)
+    writer.start()
+    try:
+        assert downloader.run()
+    finally:
+        writer.join()
+    assert read_merged(downloader) == b"".join(contents)
+    # saved segments only keep their map
+    assert downloader.segments == [{"map": None}] * count
+    assert not downloader.started_segments
+
+
+@pytest.mark.parametrize("variant, expected", [("lowest", "lowest"), (2000000, 2000000), ("2000000", 2000000)])
+def test_variant_values(tmp_path, variant, expected):
+    downloader = make_downloader(tmp_path, "http://127.0.0.1:1/index.m3u8", variant=variant)
+    assert downloader.variant == expected
+    assert not downloader.switch_down
+
+
+@pytest.mark.parametrize("variant", ["medium", "", 0, True, 2.5])
+def test_unknown_variant_is_rejected(tmp_path, variant):
+    with pytest.raises(Exception, match="unknown variant"):
+        make_downloader(tmp_path, "http://127.0.0.1:1/index.m3u8", variant=variant)
+
+
+@pytest.mark.skipif(os.name == "nt", reason="the failing ffmpeg is a shell script")
+@pytest.mark.parametrize("stream_merge", [True, False])
+def test_failed_merge_is_reported(tmp_path, file_server, stream_merge):
+    write_playlist(file_server.root, 5)
+    ffmpeg_path = tmp_path / "ffmpeg"
+    ffmpeg_path.write_text("#!/bin/sh\ncat > /dev/null\necho 'broken input' >&2\nexit 1\n")
+    ffmpeg_path.chmod(0o755)
+    downloader = make_downloader(tmp_path, file_server.url("index.m3u8"), stream_merge=stream_merge)
+    downloader.ffmpeg_path = str(ffmpeg_path)
+    assert downloader.run() is False
+    assert not os.path.exists(os.path.join(downloader.save_dir, downloader.video_folder, downloader.merge_name))
+
+
+@pytest.mark.parametrize("engine", ["thread", "asyncio"])
+def test_long_playlist_with_one_connection_per_host(tmp_path, file_server, engine):
+    # the playlist is longer than one batch, so it is still open while the segments start
+    contents = write_playlist(file_server.root, 600, size=100)
+    downloader = make_downloader(tmp_path, file_server.url("index.m3u8"), per_host_limit=1, engine=engine)
+    result = list()
+    thread = threading.Thread(target=lambda: result.append(downloader.run()), daemon=True)
+    thread.start()
+    thread.join(60)
+    assert not thread.is_alive(), "download hangs"
+    assert result == [True]
+    assert read_merged(downloader) == b"".join(contents)
+
+
+def write_byterange_playlist(root, sizes, init_size=0, name="br.m3u8"):
+    # every segment is a byte range of media.mp4, only the first one with an explicit offset, after an optional
+    # EXT-X-MAP init section at the start of the same file, returns the content of the file
+    data = os.urandom(init_size + sum(sizes))
+    with open(os.path.join(root, "media.mp4"), "wb") as f:
+        f.write(data)
+    lines = ["#EXTM3U", "#EXT-X-VERSION:7", "#EXT-X-TARGETDURATION:2"]
+    if init_size:
+        lines.append(f'#EXT-X-MAP:URI="media.mp4",BYTERANGE="{init_size}@0"')
+    for i, size in enumerate(sizes):
+        lines += ["#EXTINF:2.0,", f"#EXT-X-BYTERANGE:{size}@{init_size}" if i == 0 else f"#EXT-X-BYTERANGE:{size}",
+                  "media.mp4"]
+    lines.append("#EXT-X-ENDLIST")
+    with open(os.path.join(root, name), "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return data
+
+
+def segment_requests(server):
+    # requests for the media file, besides the one of test_download
+    return [request for request in server.requests if request[0] == "/media.mp4"][1:]
+
+
+def test_coalesce_segments(tmp_path):
+    downloader = make_downloader(tmp_path, "http://127.0.0.1:1/index.m3u8", coalesce_size=300)
+    downloader.segments = [
+        {"url": "a", "byterange": (100, 0)},
+        {"url": "a", "byterange": (100, 100)},
+        {"url": "a", "byterange": (100, 200)},
+        # over coalesce_size
+        {"url": "a", "byterange": (100, 300)},
+        # another resource
+        {"url": "b", "byterange": (100, 400)},
+        # not adjacent
+        {"url": "b", "byterange": (100, 600)},
+        {"url": "c", "byterange": None},
+        {"url": "c", "byterange": None},
+    ]
+    assert downloader.coalesce_segments(range(8)) == [[0, 1, 2], [3], [4], [5], [6], [7]]
+    # only consecutive segment numbers form a run
+    assert downloader.coalesce_segments([0, 2, 3]) == [[0], [2, 3]]
+    downloader.coalesce_size = 0
+    assert downloader.coalesce_segments(range(3)) == [[0], [1], [2]]
+
+
+@pytest.mark.parametrize("engine", ["thread", "asyncio"])
+@pytest.mark.parametrize("ranges", [True, False])
+def test_byte_ranges_are_coalesced(tmp_path, engine, ranges):
+    server = FileServer(tmp_path / "www", ranges=ranges)
+    os.makedirs(server.root)
+    try:
+        sizes = [1000 + i * 37 for i in range(30)]
+        data = write_byterange_playlist(server.root, sizes)
+        downloader = make_downloader(tmp_path, server.url("br.m3u8"), engine=engine, coalesce_size=12000)
+        assert downloader.run()
+        assert read_merged(downloader) == data
+        assert downloader.coalesced_count == 30 - len(segment_requests(server))
+        assert 3 <= len(segment_requests(server)) <= 5
+    finally:
+        server.close()
+
+
+@pytest.mark.parametrize("engine", ["thread", "asyncio"])
+def test_init_section_is_fetched_once(tmp_path, file_server, engine):
+    data = write_byterange_playlist(file_server.root, [500] * 10, init_size=300)
+    downloader = make_downloader(tmp_path, file_server.url("br.m3u8"), engine=engine, coalesce_size=0)
+    assert downloader.run()
+    # the init section is written in front of the first segment only
+    assert read_merged(downloader) == data
+    assert [request[1] for request in segment_requests(file_server)].count("bytes=0-299") == 1
@@ -0,0 +1,82 @@
+from m3u8_downloader import M3U8Loader, iter_text_lines, parse_attributes, parse_byterange
+
+MEDIA_PLAYLIST = """#EXTM3U
+#EXT-X-VERSION:7
+#EXT-X-TARGETDURATION:4
+#EXT-X-MEDIA-SEQUENCE:100
+#EXT-X-MAP:URI="init.mp4",BYTERANGE="700@0"
+#EXTINF:4.0,
+#EXT-X-BYTERANGE:1000@700
+media.mp4
+#EXTINF:4.0,
+#EXT-X-BYTERANGE:2000
+media.mp4
+#EXT-X-KEY:METHOD=AES-128,URI="key.bin",IV=0x0102
+#EXTINF:3.5,title
+#EXT-X-BYTERANGE:500
+other.mp4
+#EXTINF:2.0,
+plain.ts
+#EXT-X-ENDLIST
+"""
+
+
+def test_media_playlist():
+    playlist = M3U8Loader("index.m3u8", MEDIA_PLAYLIST.splitlines())
+    segments = list(playlist.segments())
+    assert [segment["uri"] for segment in segments] == ["media.mp4", "media.mp4", "other.mp4", "plain.ts"]
+    assert [segment["sequence"] for segment in segments] == [100, 101, 102, 103]
+    assert [segment["duration"] for segment in segments] == [4.0, 4.0, 3.5, 2.0]
+    # without an offset a range follows the previous range of the same uri, and starts at 0 for another uri
+    assert [segment["byterange"] for segment in segments] == [(1000, 700), (2000, 1700), (500, 0), None]
+    assert segments[0]["map"] == {"uri": "init.mp4", "key": None, "byterange": (700, 0)}
+    assert segments[3]["map"] is segments[0]["map"]
+    assert segments[1]["key"] is None
+    assert segments[2]["key"] == {"method": "AES-128", "uri": "key.bin", "iv": "0x0102"}
+    assert playlist.target_duration == 4.0
+    assert playlist.version == 7
+    assert playlist.is_endlist
+    assert not playlist.is_variant
+
+
+def test_master_playlist():
+    lines = [
+        "#EXTM3U",
+        '#EXT-X-STREAM-INF:BANDWIDTH=1280000,RESOLUTION=640x360,CODECS="avc1.4d401e,mp4a.40.2"',
+        "low/index.m3u8",
+        "#EXT-X-STREAM-INF:AVERAGE-BANDWIDTH=2560000,RESOLUTION=1280x720",
+        "high/index.m3u8",
+    ]
+    playlist = M3U8Loader("master.m3u8", lines).read_header()
+    assert playlist.is_variant
+    assert playlist.variants == [
+        {"bandwidth": 1280000, "resolution": "640x360", "uri": "low/index.m3u8"},
+        {"bandwidth": 2560000, "resolution": "1280x720", "uri": "high/index.m3u8"},
+    ]
+    assert list(playlist.segments()) == list()
+
+
+def test_segments_are_yielded_while_the_playlist_is_read():
+    read_lines = list()
+
+    def lines():
+        for line in MEDIA_PLAYLIST.splitlines():
+            read_lines.append(line)
+            yield line
+
+    playlist = M3U8Loader("index.m3u8", lines()).read_header()
+    assert playlist.first_segment["uri"] == "media.mp4"
+    assert read_lines[-1] == "media.mp4"
+    assert not playlist.is_endlist
+
+
+def test_json_escaped_playlist():
+    lines = list(iter_text_lines(['#EXTM3U\\n#EXTINF:2.0,\\nhttps:\\/\\/a.com\\/s0.ts\\n']))
+    assert lines == ["#EXTM3U", "#EXTINF:2.0,", "https://a.com/s0.ts", ""]
+
+
+def test_attributes_and_byteranges():
+    assert parse_attributes('METHOD=AES-128,URI="a,b.key",IV=0x1') == {"METHOD": "AES-128", "URI": "a,b.key",
+                                                                       "IV": "0x1"}
+    assert parse_byterange("100@20", 500) == (100, 20)
+    assert parse_byterange("100", 500) == (100, 500)
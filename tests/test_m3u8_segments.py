@@ -0,0 +1,115 @@
+import os
+
+import pytest
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+
+from m3u8_downloader import SegmentDecryptor, SegmentFetch, SegmentSplitter, get_byte_window
+from utils.retry_utils import RetryPolicy
+
+
+def encrypt(data, key, iv):
+    return AES.new(key, AES.MODE_CBC, iv).encrypt(pad(data, AES.block_size))
+
+
+def feed_in_chunks(splitter, data, chunk_size):
+    for pos in range(0, len(data), chunk_size):
+        splitter.feed(data[pos:pos + chunk_size])
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 16, 1000, 100000])
+def test_splitter_decrypts_every_segment_of_a_window_with_its_own_key(chunk_size):
+    plains = [os.urandom(size) for size in (1000, 31, 4096)]
+    keys = [(os.urandom(16), os.urandom(16)) for _ in plains]
+    ciphers = [encrypt(plain, key, iv) for plain, (key, iv) in zip(plains, keys)]
+    splitter = SegmentSplitter([len(cipher) for cipher in ciphers],
+                               [SegmentDecryptor(key, iv) for key, iv in keys])
+    # segment boundaries fall inside the chunks
+    feed_in_chunks(splitter, b"".join(ciphers), chunk_size)
+    assert splitter.finish() == plains
+
+
+def test_splitter_mixes_plain_and_encrypted_segments():
+    key, iv = os.urandom(16), os.urandom(16)
+    plains = [os.urandom(100), os.urandom(200)]
+    splitter = SegmentSplitter([100, 208], [None, SegmentDecryptor(key, iv)])
+    feed_in_chunks(splitter, plains[0] + encrypt(plains[1], key, iv), 64)
+    assert splitter.finish() == plains
+
+
+def test_splitter_without_lengths_takes_the_whole_response():
+    data = os.urandom(5000)
+    splitter = SegmentSplitter([None], [None])
+    feed_in_chunks(splitter, data, 999)
+    assert splitter.finish() == [data]
+
+
+def test_byte_window():
+    segments = [{"byterange": (100, 50)}, {"byterange": (200, 150)}, {"byterange": (10, 350)}]
+    assert get_byte_window(segments) == (50, 359)
+    assert get_byte_window(segments[1:2]) == (150, 349)
+    assert get_byte_window([{"byterange": None}]) == (0, None)
+
+
+def make_fetch(segments, retry_policy=None):
+    return SegmentFetch(segments, lambda segment: None, retry_policy or RetryPolicy())
+
+
+def read_response(fetch, body, chunk_size=64):
+    # what the engines do with a response body
+    for pos in range(0, len(body), chunk_size):
+        if fetch.feed(fetch.clip(body[pos:pos + chunk_size])):
+            break
+
+
+def test_fetch_asks_for_the_window():
+    fetch = make_fetch([{"byterange": (100, 50)}, {"byterange": (200, 150)}])
+    assert fetch.get_headers({"User-Agent": "a"}) == {"User-Agent": "a", "Range": "bytes=50-349"}
+    assert make_fetch([{"byterange": None}]).get_headers(None) == dict()
+
+
+def test_fetch_cuts_the_window_out_of_a_200_reply_to_a_range_request():
+    resource = os.urandom(1000)
+    fetch = make_fetch([{"byterange": (100, 50)}, {"byterange": (200, 150)}])
+    headers = fetch.get_headers(None)
+    assert fetch.start_response(200, headers)
+    read_response(fetch, resource, chunk_size=37)
+    assert fetch.finish() == [resource[50:150], resource[150:350]]
+
+
+def test_fetch_continues_a_broken_range_response():
+    resource = os.urandom(1000)
+    retry_policy = RetryPolicy()
+    fetch = make_fetch([{"byterange": (100, 50)}, {"byterange": (200, 150)}], retry_policy)
+    headers = fetch.get_headers(None)
+    assert fetch.start_response(206, headers)
+    read_response(fetch, resource[50:180])
+    with pytest.raises(Exception, match="response ended after 130 of 300 Bytes"):
+        fetch.finish()
+    # the next attempt asks for the rest and keeps what arrived
+    headers = fetch.get_headers(None)
+    assert headers["Range"] == "bytes=180-349"
+    assert fetch.start_response(206, headers)
+    read_response(fetch, resource[180:350])
+    assert fetch.finish() == [resource[50:150], resource[150:350]]
+    assert retry_policy.get_stats()["refetched_size"] == 0
+
+
+def test_fetch_starts_over_on_a_200_after_a_broken_response():
+    resource = os.urandom(1000)
+    retry_policy = RetryPolicy()
+    fetch = make_fetch([{"byterange": (300, 50)}], retry_policy)
+    assert fetch.start_response(206, fetch.get_headers(None))
+    read_response(fetch, resource[50:120])
+    assert fetch.start_response(200, fetch.get_headers(None))
+    read_response(fetch, resource)
+    assert fetch.finish() == [resource[50:350]]
+    assert retry_policy.get_stats()["refetched_size"] == 70
+
+
+def test_fetch_rejects_unusable_responses():
+    fetch = make_fetch([{"byterange": None}])
+    # a 206 without a Range header of ours isn't the whole segment
+    assert not fetch.start_response(206, dict())
+    assert not fetch.start_response(404, {"Range": "bytes=0-"})
+    assert fetch.start_response(200, dict())
@@ -0,0 +1,66 @@
+import json
+import urllib.request
+
+from utils.metrics_utils import CallbackExporter, JsonLinesExporter, Metrics, PrometheusExporter, format_prometheus
+
+
+def fill(metrics):
+    metrics.inc("requests_total", status=206)
+    metrics.inc("requests_total", status=206)
+    metrics.inc("requests_total", status="error")
+    metrics.observe("request_seconds", 0.5, worker=0)
+    metrics.observe("request_seconds", 1.5, worker=0)
+    metrics.observe("request_seconds", 2.0, worker="single")
+    metrics.set("queue_depth", 3)
+
+
+def test_snapshot_with_mixed_label_types():
+    metrics = Metrics("test")
+    fill(metrics)
+    assert metrics.snapshot() == [
+        {"metric": "test_queue_depth", "type": "gauge", "labels": {}, "value": 3},
+        {"metric": "test_request_seconds", "type": "summary", "labels": {"worker": "0"}, "count": 2, "sum": 2.0,
+         "max": 1.5},
+        {"metric": "test_request_seconds", "type": "summary", "labels": {"worker": "single"}, "count": 1, "sum": 2.0,
+         "max": 2.0},
+        {"metric": "test_requests_total", "type": "counter", "labels": {"status": "206"}, "value": 2},
+        {"metric": "test_requests_total", "type": "counter", "labels": {"status": "error"}, "value": 1},
+    ]
+
+
+def test_format_prometheus():
+    metrics = Metrics("test")
+    fill(metrics)
+    metrics.inc("requests_total", status='a"b\\c\nd')
+    assert format_prometheus(metrics.snapshot()).splitlines() == [
+        "# TYPE test_queue_depth gauge",
+        "test_queue_depth 3",
+        "# TYPE test_request_seconds summary",
+        'test_request_seconds_count{worker="0"} 2',
+        'test_request_seconds_sum{worker="0"} 2.0',
+        'test_request_seconds_count{worker="single"} 1',
+        'test_request_seconds_sum{worker="single"} 2.0',
+        "# TYPE test_requests_total counter",
+        'test_requests_total{status="206"} 2',
+        'test_requests_total{status="a\\"b\\\\c\\nd"} 1',
+        'test_requests_total{status="error"} 1',
+    ]
+
+
+def test_exporters(tmp_path):
+    events = list()
+    json_path = tmp_path / "metrics.jsonl"
+    prometheus = PrometheusExporter(port=0)
+    metrics = Metrics("test", [CallbackExporter(events.append), JsonLinesExporter(str(json_path)), prometheus])
+    try:
+        fill(metrics)
+        metrics.export_summary()
+        url = f"http://127.0.0.1:{prometheus.server.server_port}/metrics"
+        with urllib.request.urlopen(url, timeout=10) as res:
+            assert res.read().decode() == format_prometheus(metrics.snapshot())
+    finally:
+        metrics.close()
+    assert [event["type"] for event in events] == ["counter"] * 3 + ["summary"] * 3 + ["gauge", "snapshot"]
+    assert events[2]["labels"] == {"status": "error"}
+    lines = [json.loads(line) for line in json_path.read_text().splitlines()]
+    assert lines[-1]["value"] == metrics.snapshot()
@@ -0,0 +1,76 @@
+import threading
+import time
+
+from utils.scheduler_utils import RangeScheduler
+
+
+def test_ranges_are_cut_into_pages():
+    scheduler = RangeScheduler([[0, 249], [300, 309]], page_size=100, min_steal_size=10)
+    pages = [scheduler.next_page(i) for i in range(4)]
+    assert [(page["start_pos"], page["end_pos"]) for page in pages] == [(0, 99), (100, 199), (200, 249), (300, 309)]
+
+
+def test_steal_takes_the_second_half_of_the_largest_page():
+    scheduler = RangeScheduler([[0, 99], [100, 139]], page_size=100, min_steal_size=10)
+    large = scheduler.next_page("a")
+    scheduler.next_page("b")
+    stolen = scheduler.next_page("c")
+    assert stolen == {"start_pos": 50, "end_pos": 99}
+    assert large == {"start_pos": 0, "end_pos": 49}
+    assert scheduler.get_stats()["steals"] == 1
+
+
+def test_small_pages_are_not_stolen():
+    scheduler = RangeScheduler([[0, 18]], page_size=100, min_steal_size=10)
+    scheduler.next_page("a")
+    assert scheduler.next_page("b") is None
+
+
+def test_claim_after_a_steal_stops_at_the_split_point():
+    scheduler = RangeScheduler([[0, 99]], page_size=100, min_steal_size=10)
+    page = scheduler.next_page("a")
+    assert scheduler.claim(page, 30) == 30
+    scheduler.advance(page, 30)
+    stolen = scheduler.next_page("b")
+    assert stolen == {"start_pos": 65, "end_pos": 99}
+    # the owner's next chunk reaches into the stolen half, only the bytes before it are still its own
+    assert scheduler.claim(page, 64) == 35
+    scheduler.advance(page, 35)
+    assert scheduler.claim(page, 64) == 0
+    assert scheduler.get_range(page) is None
+
+
+def test_steals_racing_claims_cover_every_byte_once():
+    total_size = 1024 * 256
+    chunk_size = 64
+    # chunks never exceed min_steal_size, so a split always lands beyond the chunk an owner is writing
+    scheduler = RangeScheduler([[0, total_size - 1]], page_size=total_size, min_steal_size=chunk_size)
+    coverage = bytearray(total_size)
+
+    def worker(worker_name):
+        while True:
+            page = scheduler.next_page(worker_name)
+            if not page:
+                break
+            while True:
+                current_range = scheduler.get_range(page)
+                if not current_range:
+                    break
+                size = scheduler.claim(page, chunk_size)
+                if not size:
+                    break
+                # claim() and the write run outside the lock, like a worker writing a chunk to disk
+                start_pos = page["start_pos"]
+                for pos in range(start_pos, start_pos + size):
+                    coverage[pos] += 1
+                time.sleep(0)
+                scheduler.advance(page, size)
+            scheduler.finish_page(worker_name, page, 0, True)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert scheduler.get_stats()["steals"] > 0
+    assert coverage == bytearray([1]) * total_size
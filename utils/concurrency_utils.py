@@ -0,0 +1,180 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import requests
+
+THROTTLE_STATUS_CODES = (429, 503)
+# throughput has to grow by this ratio for another increase, and may drop by it before an increase is undone
+IMPROVE_RATIO = 0.05
+# mean latency of a window above baseline * LATENCY_FACTOR is treated like queueing at the origin
+LATENCY_FACTOR = 2.0
+# and at least this many seconds above it, so jitter on very fast responses doesn't count as queueing
+MIN_LATENCY_RISE = 0.05
+# windows to stay at a level where the last increase didn't pay off before probing one higher again
+PROBE_WINDOWS = 5
+
+
+class AdaptiveConcurrency:
+    # AIMD controller for the number of requests in flight: while the aggregate throughput keeps improving the
+    # level grows (doubling until the first back off, one by one afterwards), 429/503, timeouts and rising
+    # latency cut it down multiplicatively, an increase that doesn't pay off is kept for a few windows before
+    # the next probe
+    def __init__(self, max_level, min_level=1, initial_level=None, interval=1.0, logger=None, name="concurrency"):
+        self.max_level = max(max_level, 1)
+        self.min_level = min(max(min_level, 1), self.max_level)
+        self.level = min(max(initial_level or self.min_level, self.min_level), self.max_level)
+        self.interval = interval
+        self.logger = logger
+        self.name = name
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.slow_start = True
+        self.window_start = time.time()
+        self.window_size = 0
+        self.window_latencies = list()
+        self.window_throttled = 0
+        self.last_throughput = None
+        self.last_change = None
+        self.hold_count = 0
+        self.baseline_latency = None
+        self.increase_count = 0
+        self.decrease_count = 0
+        self.throttled_count = 0
+        self.highest_level = self.level
+        self.lowest_level = self.level
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= self.level:
+                self.condition.wait()
+            self.take()
+
+    def try_acquire(self):
+        # for the asyncio engine, which must not block its event loop
+        with self.condition:
+            if self.in_flight >= self.level:
+                return False
+            self.take()
+            return True
+
+    def take(self):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def release(self, latency=None, throttled=False):
+        # latency: seconds until the response headers arrived, throttled: 429/503 or a timeout
+        with self.condition:
+            self.in_flight -= 1
+            if latency is not None:
+                self.window_latencies.append(latency)
+            if throttled:
+                self.window_throttled += 1
+                self.throttled_count += 1
+            self.maybe_adjust()
+            self.condition.notify_all()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        result = {"latency": None, "throttled": False}
+        try:
+            yield result
+        finally:
+            self.release(result["latency"], result["throttled"])
+
+    def add_bytes(self, size):
+        with self.condition:
+            self.window_size += size
+            if self.maybe_adjust():
+                self.condition.notify_all()
+
+    def maybe_adjust(self):
+        now = time.time()
+        elapsed = now - self.window_start
+        if elapsed < self.interval:
+            return False
+        throughput = self.window_size / elapsed
+        latency = sum(self.window_latencies) / len(self.window_latencies) if self.window_latencies else None
+        if latency is not None:
+            self.baseline_latency = latency if self.baseline_latency is None else min(self.baseline_latency, latency)
+        old_level = self.level
+        reason = None
+        if self.window_throttled:
+            self.level = max(self.level // 2, self.min_level)
+            reason = f"{self.window_throttled} throttled requests"
+        elif latency is not None and self.level > self.min_level and \
+                latency > max(self.baseline_latency * LATENCY_FACTOR, self.baseline_latency + MIN_LATENCY_RISE):
+            self.level = max(int(self.level * 0.75), self.min_level)
+            reason = "latency {:.3f}s, baseline {:.3f}s".format(latency, self.baseline_latency)
+        elif self.last_change == "up" and throughput < self.last_throughput * (1 - IMPROVE_RATIO):
+            # the last increase made things worse
+            self.level = max(self.level - 1, self.min_level)
+            reason = "throughput dropped after the last increase"
+        elif self.last_change == "up" and throughput <= self.last_throughput * (1 + IMPROVE_RATIO):
+            # the last increase didn't pay off, stay here for a while
+            self.slow_start = False
+            self.hold_count = PROBE_WINDOWS
+        elif self.hold_count:
+            self.hold_count -= 1
+        elif self.in_flight + 1 >= self.level:
+            # only grow while the current level is actually in use
+            step = self.level if self.slow_start else 1
+            self.level = min(self.level + step, self.max_level)
+            reason = "probing" if self.last_change != "up" else "throughput improving"
+        if self.level < old_level:
+            self.slow_start = False
+            self.decrease_count += 1
+            self.last_change = "down"
+        elif self.level > old_level:
+            self.increase_count += 1
+            self.last_change = "up"
+        else:
+            self.last_change = None
+        self.highest_level = max(self.highest_level, self.level)
+        self.lowest_level = min(self.lowest_level, self.level)
+        if self.logger and self.level != old_level:
+            self.logger.info("{} level {} -> {} ({}), throughput: {:.2f} MB/s, latency: {}".format(
+                self.name, old_level, self.level, reason, throughput / (1024 * 1024),
+                "{:.3f}s".format(latency) if latency is not None else "-"))
+        self.last_throughput = throughput
+        self.window_start = now
+        self.window_size = 0
+        self.window_latencies = list()
+        self.window_throttled = 0
+        return self.level != old_level
+
+    def get_stats(self):
+        with self.condition:
+            return {
+                "level": self.level,
+                "lowest_level": self.lowest_level,
+                "highest_level": self.highest_level,
+                "peak_in_flight": self.peak_in_flight,
+                "increases": self.increase_count,
+                "decreases": self.decrease_count,
+                "throttled": self.throttled_count,
+            }
+
+
+def request_slot(concurrency):
+    # the slot of the controller, or a stand-in with the same result dict when concurrency is fixed
+    return concurrency.slot() if concurrency else nullcontext({"latency": None, "throttled": False})
+
+
+def format_concurrency_stats(stats):
+    return "concurrency level: final {}, lowest {}, highest {}, increases: {}, decreases: {}, " \
+           "throttled requests: {}".format(stats["level"], stats["lowest_level"], stats["highest_level"],
+                                            stats["increases"], stats["decreases"], stats["throttled"])
+
+
+def is_throttled(status_code=None, error=None):
+    if status_code in THROTTLE_STATUS_CODES:
+        return True
+    if error is None:
+        return False
+    # a read timeout in the middle of a body surfaces as a ConnectionError in requests
+    return isinstance(error, (requests.exceptions.Timeout, asyncio.TimeoutError, TimeoutError)) or \
+        "timed out" in str(error)
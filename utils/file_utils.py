@@ -0,0 +1,149 @@
+import mmap
+import os
+import sys
+import tempfile
+import threading
+import time
+
+
+class RangeWriter:
+    # writes byte ranges of a preallocated file from many threads without a shared lock:
+    # os.pwrite on POSIX, one descriptor per thread elsewhere, or a shared memory map if use_mmap
+    def __init__(self, path, total_size, use_mmap=False):
+        self.path = path
+        self.total_size = total_size
+        self.use_mmap = use_mmap and total_size > 0
+        self.fd = None
+        self.mmap = None
+        self.local = threading.local()
+        self.thread_fds = list()
+        self.thread_fds_lock = threading.Lock()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def open(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o666)
+        self.preallocate()
+        if self.use_mmap:
+            self.mmap = mmap.mmap(self.fd, self.total_size)
+        return self
+
+    def preallocate(self):
+        if os.fstat(self.fd).st_size != self.total_size:
+            os.ftruncate(self.fd, self.total_size)
+        if hasattr(os, "posix_fallocate") and self.total_size:
+            try:
+                os.posix_fallocate(self.fd, 0, self.total_size)
+            except OSError:
+                # not supported by every file system, the sparse file from ftruncate still works
+                pass
+
+    def get_thread_fd(self):
+        fd = getattr(self.local, "fd", None)
+        if fd is None:
+            fd = os.open(self.path, os.O_WRONLY | getattr(os, "O_BINARY", 0))
+            self.local.fd = fd
+            with self.thread_fds_lock:
+                self.thread_fds.append(fd)
+        return fd
+
+    def write(self, offset, data):
+        size = len(data)
+        if self.mmap is not None:
+            self.mmap[offset:offset + size] = data
+            return size
+        view = memoryview(data)
+        if hasattr(os, "pwrite"):
+            while view:
+                written = os.pwrite(self.fd, view, offset)
+                view = view[written:]
+                offset += written
+            return size
+        fd = self.get_thread_fd()
+        os.lseek(fd, offset, os.SEEK_SET)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+        return size
+
+    def sync(self):
+        if self.mmap is not None:
+            self.mmap.flush()
+        with self.thread_fds_lock:
+            for fd in self.thread_fds:
+                os.fsync(fd)
+        os.fsync(self.fd)
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.flush()
+            self.mmap.close()
+            self.mmap = None
+        with self.thread_fds_lock:
+            for fd in self.thread_fds:
+                os.close(fd)
+            self.thread_fds.clear()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def benchmark_write(total_size=1024 * 1024 * 256, chunk_size=1024 * 100, thread_counts=(1, 2, 4, 8, 16)):
+    data = os.urandom(chunk_size)
+    folder = tempfile.mkdtemp(prefix="range_writer_")
+    path = os.path.join(folder, "benchmark.bin")
+
+    def write_pages(write_func, thread_count):
+        page_size = total_size // thread_count
+
+        def worker(start_pos, end_pos):
+            while start_pos < end_pos:
+                size = min(chunk_size, end_pos - start_pos)
+                write_func(start_pos, data[:size])
+                start_pos += size
+
+        threads = [threading.Thread(target=worker, args=(i * page_size, (i + 1) * page_size))
+                   for i in range(thread_count)]
+        start_time = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.time() - start_time
+
+    try:
+        for thread_count in thread_counts:
+            lock = threading.Lock()
+            with open(path, "wb+") as f:
+                f.truncate(total_size)
+
+                def locked_write(offset, chunk):
+                    with lock:
+                        f.seek(offset)
+                        f.write(chunk)
+
+                locked_time = write_pages(locked_write, thread_count)
+            os.remove(path)
+            with RangeWriter(path, total_size) as writer:
+                positional_time = write_pages(writer.write, thread_count)
+            os.remove(path)
+            with RangeWriter(path, total_size, use_mmap=True) as writer:
+                mmap_time = write_pages(writer.write, thread_count)
+            os.remove(path)
+            size_mb = total_size / (1024 * 1024)
+            print("threads: %2d, lock+seek: %8.2f MB/s, positional: %8.2f MB/s, mmap: %8.2f MB/s" % (
+                thread_count, size_mb / locked_time, size_mb / positional_time, size_mb / mmap_time
+            ))
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+        os.rmdir(folder)
+
+
+if __name__ == '__main__':
+    # python -m utils.file_utils [size_mb]
+    benchmark_write(total_size=int(sys.argv[1]) * 1024 * 1024 if len(sys.argv) > 1 else 1024 * 1024 * 256)
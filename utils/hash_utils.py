@@ -0,0 +1,108 @@
+import base64
+import binascii
+import hashlib
+import re
+import threading
+
+ALGORITHMS = ("sha256", "md5")
+# names used by the Digest / Repr-Digest headers
+HEADER_ALGORITHMS = {"sha-256": "sha256", "md5": "md5"}
+
+
+def parse_expected_digest(value):
+    # "sha256:<hex>", "md5:<hex>" or just the hex digest, the algorithm is then taken from its length
+    algorithm, _, digest = value.strip().rpartition(":")
+    algorithm = algorithm.lower().replace("-", "")
+    digest = digest.lower()
+    if not algorithm:
+        algorithm = {32: "md5", 64: "sha256"}.get(len(digest))
+    if algorithm not in ALGORITHMS or not re.fullmatch(r"[0-9a-f]+", digest) or \
+            len(digest) != hashlib.new(algorithm).digest_size * 2:
+        raise Exception(f"unsupported digest: {value}, use sha256:<hex> or md5:<hex>")
+    return algorithm, digest
+
+
+def base64_to_hex(value):
+    try:
+        return binascii.hexlify(base64.b64decode(value.strip().strip(":"), validate=True)).decode()
+    except (binascii.Error, ValueError):
+        return None
+
+
+def get_server_digest(headers):
+    # (algorithm, hex digest, source) of the whole file from a HEAD response, None if the server doesn't tell
+    for name in ("Repr-Digest", "Digest"):
+        for item in headers.get(name, "").split(","):
+            key, _, value = item.strip().partition("=")
+            algorithm = HEADER_ALGORITHMS.get(key.strip().lower())
+            digest = base64_to_hex(value) if algorithm else None
+            if digest:
+                return algorithm, digest, name
+    digest = base64_to_hex(headers.get("Content-MD5", ""))
+    if digest:
+        return "md5", digest, "Content-MD5"
+    # S3 and many static servers use the MD5 of single part uploads as ETag, it is only a hint
+    etag = headers.get("ETag", "").strip('"').lower()
+    if re.fullmatch(r"[0-9a-f]{32}", etag):
+        return "md5", etag, "ETag"
+    return None
+
+
+class PrefixHasher:
+    # hashes a file that is being written out of order: a background thread reads whatever part at the start of
+    # the file is already complete (get_ready_size), so the hash is ready shortly after the last byte arrives
+    # instead of needing a second full read; recently written data usually still comes from the page cache
+    def __init__(self, path, algorithm, get_ready_size, chunk_size=1024 * 1024, interval=0.2):
+        self.path = path
+        self.algorithm = algorithm
+        self.hash = hashlib.new(algorithm)
+        self.get_ready_size = get_ready_size
+        self.chunk_size = chunk_size
+        self.interval = interval
+        self.hashed_size = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.error = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.work, name="PrefixHasher", daemon=True)
+        self.thread.start()
+        return self
+
+    def work(self):
+        try:
+            # unbuffered, a read-ahead buffer would keep the zeros of not yet written parts
+            with open(self.path, "rb", buffering=0) as f:
+                while not self.stop_event.is_set():
+                    if not self.update(f, self.get_ready_size()):
+                        self.stop_event.wait(self.interval)
+        except Exception as e:
+            self.error = e
+
+    def update(self, f, ready_size):
+        if ready_size <= self.hashed_size:
+            return False
+        f.seek(self.hashed_size)
+        while self.hashed_size < ready_size and not self.stop_event.is_set():
+            data = f.read(min(self.chunk_size, ready_size - self.hashed_size))
+            if not data:
+                break
+            self.hash.update(data)
+            self.hashed_size += len(data)
+        return True
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+    def finish(self, total_size):
+        # stops the thread and hashes whatever is left up to total_size
+        self.stop()
+        if self.error:
+            raise self.error
+        tail_size = max(total_size - self.hashed_size, 0)
+        with open(self.path, "rb", buffering=0) as f:
+            self.stop_event.clear()
+            self.update(f, total_size)
+        return self.hash.hexdigest(), tail_size
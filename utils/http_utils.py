@@ -0,0 +1,137 @@
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 10
+
+
+class HttpClient:
+    # one keep-alive requests.Session shared by all worker threads of one or more downloads,
+    # pool_size connections are kept per host, per_host_limit and max_connections make requests wait for a slot
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, per_host_limit=None, max_hosts=10, max_connections=None):
+        self.pool_size = max(pool_size or DEFAULT_POOL_SIZE, 1)
+        self.per_host_limit = per_host_limit
+        self.max_connections = max_connections
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(
+            pool_connections=max_hosts,
+            pool_maxsize=per_host_limit if per_host_limit else self.pool_size,
+        )
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        self.lock = threading.Lock()
+        self.request_count = 0
+        # connections opened by another client that shares the slots, e.g. the aiohttp session of the asyncio engine
+        self.other_connection_count = 0
+        self.connection_slots = threading.BoundedSemaphore(max_connections) if max_connections else None
+        self.host_slots = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get_host_slot(self, url):
+        if not self.per_host_limit:
+            return None
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self.host_slots[host]
+
+    @contextmanager
+    def slot(self, url):
+        host_slot = self.get_host_slot(url)
+        if host_slot:
+            host_slot.acquire()
+        if self.connection_slots:
+            self.connection_slots.acquire()
+        try:
+            yield
+        finally:
+            self.release(url)
+
+    def try_acquire(self, url):
+        # slot() without waiting, for an event loop that polls instead of blocking, release() gives it back
+        host_slot = self.get_host_slot(url)
+        if host_slot and not host_slot.acquire(blocking=False):
+            return False
+        if self.connection_slots and not self.connection_slots.acquire(blocking=False):
+            if host_slot:
+                host_slot.release()
+            return False
+        return True
+
+    def release(self, url):
+        if self.connection_slots:
+            self.connection_slots.release()
+        host_slot = self.get_host_slot(url)
+        if host_slot:
+            host_slot.release()
+
+    def count_request(self):
+        # a request sent by another client under these slots, so get_stats() covers it too
+        with self.lock:
+            self.request_count += 1
+
+    def count_connection(self):
+        with self.lock:
+            self.other_connection_count += 1
+
+    def send(self, method, url, **kwargs):
+        with self.lock:
+            self.request_count += 1
+        return self.session.request(method, url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        with self.slot(url):
+            return self.send(method, url, **kwargs)
+
+    @contextmanager
+    def stream(self, url, **kwargs):
+        # the slot is held until the body has been consumed and the response is closed
+        kwargs.setdefault("allow_redirects", True)
+        with self.slot(url):
+            res = self.send("GET", url, stream=True, **kwargs)
+            try:
+                yield res
+            finally:
+                res.close()
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("allow_redirects", True)
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault("allow_redirects", False)
+        return self.request("HEAD", url, **kwargs)
+
+    def get_stats(self):
+        # every new connection of a host pool is one TCP (+TLS) handshake
+        connection_count = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool:
+                connection_count += pool.num_connections
+        with self.lock:
+            request_count = self.request_count
+            connection_count += self.other_connection_count
+        return {
+            "requests": request_count,
+            "connections": connection_count,
+            "handshakes_saved": max(request_count - connection_count, 0),
+        }
+
+    def close(self):
+        self.session.close()
+
+
+def format_http_stats(stats):
+    return "http requests: {}, connections opened: {}, handshakes saved: {}".format(
+        stats["requests"], stats["connections"], stats["handshakes_saved"])
@@ -0,0 +1,166 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+
+def dump_json_atomic(path, data):
+    # write to a temporary file first so a crash never leaves a half written json behind
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_json(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class RangeJournal:
+    # sidecar file recording which byte ranges (inclusive) of a download are already on disk
+    def __init__(self, path, validators, flush_interval=2.0):
+        self.path = path
+        self.validators = validators
+        self.flush_interval = flush_interval
+        self.starts = list()
+        self.ends = list()
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.last_flush_time = time.time()
+
+    def load(self):
+        data = load_json(self.path)
+        if not data or data.get("validators") != self.validators:
+            return False
+        with self.lock:
+            self.starts.clear()
+            self.ends.clear()
+            for start, end in data.get("ranges", []):
+                self._add(start, end)
+        return True
+
+    def add(self, start, end):
+        with self.lock:
+            self._add(start, end)
+
+    def _add(self, start, end):
+        # keep the ranges sorted and merged, adjacent ranges are joined into one
+        i = bisect.bisect_left(self.ends, start - 1)
+        j = i
+        while j < len(self.starts) and self.starts[j] <= end + 1:
+            start = min(start, self.starts[j])
+            end = max(end, self.ends[j])
+            j += 1
+        self.starts[i:j] = [start]
+        self.ends[i:j] = [end]
+
+    def get_ranges(self):
+        with self.lock:
+            return [[start, end] for start, end in zip(self.starts, self.ends)]
+
+    def completed_size(self):
+        with self.lock:
+            return sum(end - start + 1 for start, end in zip(self.starts, self.ends))
+
+    def prefix_size(self):
+        # length of the completed data at the start of the file, without holes
+        with self.lock:
+            return self.ends[0] + 1 if self.starts and self.starts[0] == 0 else 0
+
+    def missing_ranges(self, total_size):
+        missing = list()
+        position = 0
+        for start, end in self.get_ranges():
+            if start > position:
+                missing.append([position, start - 1])
+            position = max(position, end + 1)
+        if position < total_size:
+            missing.append([position, total_size - 1])
+        return missing
+
+    def maybe_flush(self, sync_func=None):
+        if time.time() - self.last_flush_time < self.flush_interval:
+            return
+        if not self.flush_lock.acquire(blocking=False):
+            return
+        try:
+            self._flush(sync_func)
+        finally:
+            self.flush_lock.release()
+
+    def flush(self, sync_func=None):
+        with self.flush_lock:
+            self._flush(sync_func)
+
+    def _flush(self, sync_func):
+        ranges = self.get_ranges()
+        # the recorded ranges must be durable before the journal claims them
+        if sync_func:
+            sync_func()
+        dump_json_atomic(self.path, {"validators": self.validators, "ranges": ranges})
+        self.last_flush_time = time.time()
+
+    def remove(self):
+        for path in (self.path, f"{self.path}.tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class SegmentJournal:
+    # sidecar file of a segmented (m3u8) download: index -> {"url", "size", "md5"} of every segment file on disk
+    def __init__(self, path, validators, flush_interval=2.0):
+        self.path = path
+        self.validators = validators
+        self.flush_interval = flush_interval
+        self.segments = dict()
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.last_flush_time = time.time()
+
+    def load(self):
+        data = load_json(self.path)
+        if not data or data.get("validators") != self.validators:
+            return False
+        with self.lock:
+            self.segments = {int(index): item for index, item in data.get("segments", dict()).items()}
+        return True
+
+    def add(self, index, url, size, md5):
+        with self.lock:
+            self.segments[index] = {"url": url, "size": size, "md5": md5}
+
+    def get(self, index):
+        with self.lock:
+            return self.segments.get(index)
+
+    def maybe_flush(self):
+        if time.time() - self.last_flush_time < self.flush_interval:
+            return
+        if not self.flush_lock.acquire(blocking=False):
+            return
+        try:
+            self._flush()
+        finally:
+            self.flush_lock.release()
+
+    def flush(self):
+        with self.flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self.lock:
+            segments = {str(index): item for index, item in self.segments.items()}
+        dump_json_atomic(self.path, {"validators": self.validators, "segments": segments})
+        self.last_flush_time = time.time()
+
+    def remove(self):
+        for path in (self.path, f"{self.path}.tmp"):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,161 @@
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import deque
+
+
+def find_ffmpeg(ffmpeg_path=None):
+    # the configured program first, then whatever ffmpeg is on PATH
+    if ffmpeg_path and os.path.isfile(ffmpeg_path):
+        return ffmpeg_path
+    return shutil.which("ffmpeg")
+
+
+class FFmpegPipe:
+    # file-like sink that feeds everything written to it into ffmpeg's stdin and remuxes it to output_path,
+    # stderr is forwarded to the logger line by line
+    def __init__(self, ffmpeg_path, output_path, logger, input_format=None):
+        self.name = output_path
+        self.logger = logger
+        self.stderr_lines = deque(maxlen=20)
+        cmd = [ffmpeg_path, "-hide_banner", "-nostdin", "-loglevel", "warning", "-y"]
+        if input_format:
+            cmd += ["-f", input_format]
+        cmd += ["-i", "pipe:0", "-c", "copy", output_path]
+        self.logger.info(f"merge cmd: {subprocess.list2cmdline(cmd)}")
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        self.stderr_thread = threading.Thread(target=self.read_stderr, daemon=True)
+        self.stderr_thread.start()
+
+    def read_stderr(self):
+        for line in iter(self.process.stderr.readline, b""):
+            line = line.decode("utf-8", errors="replace").rstrip()
+            if line:
+                self.stderr_lines.append(line)
+                self.logger.warning(f"ffmpeg: {line}")
+
+    def write(self, data):
+        self.process.stdin.write(data)
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        return_code = self.process.wait()
+        self.stderr_thread.join()
+        return return_code
+
+
+class SegmentAssembler:
+    # appends segments to the output in index order as soon as they arrive, out of order segments wait in
+    # memory (at most max_buffer_count) or, beyond that, in spill files next to the output
+    def __init__(self, output, spill_dir, file_type=".ts", max_buffer_count=64, first_index=0):
+        self.output = output
+        self.spill_dir = spill_dir
+        self.file_type = file_type
+        self.max_buffer_count = max(max_buffer_count, 0)
+        self.next_index = first_index
+        self.pending = dict()
+        self.buffer_count = 0
+        self.spill_count = 0
+        self.written_count = 0
+        self.written_size = 0
+        self.skipped_count = 0
+        self.writing = False
+        self.error = None
+        self.lock = threading.Lock()
+        self.first_write_time = None
+        self.last_write_time = None
+
+    def get_spill_path(self, index):
+        return os.path.join(self.spill_dir, "{0:0>8}".format(index) + str(self.file_type))
+
+    def push(self, index, data=None, path=None):
+        # data: the segment content, path: the segment file if it is already on disk (kept segments)
+        with self.lock:
+            if self.error or index < self.next_index or index in self.pending:
+                return
+            is_full = index != self.next_index and self.buffer_count >= self.max_buffer_count
+        is_spilled = False
+        if is_full and path:
+            data = None
+        elif is_full:
+            path = self.get_spill_path(index)
+            with open(path, "wb") as f:
+                f.write(data)
+            data = None
+            is_spilled = True
+        with self.lock:
+            # in memory segments that can't be written yet count against the buffer limit
+            is_buffered = data is not None and index != self.next_index
+            self.buffer_count += is_buffered
+            self.spill_count += is_spilled
+            self.pending[index] = (data, path, is_spilled, is_buffered)
+            if self.writing:
+                return
+            self.writing = True
+        self.drain()
+
+    def skip(self, index):
+        # a segment that will never arrive, the segments behind it are written without it
+        with self.lock:
+            if self.error or index < self.next_index or index in self.pending:
+                return
+            self.pending[index] = (None, None, False, False)
+            if self.writing:
+                return
+            self.writing = True
+        self.drain()
+
+    def drain(self):
+        # only one thread writes at a time, the others just leave their segment in pending
+        while True:
+            with self.lock:
+                item = self.pending.pop(self.next_index, None)
+                if item is None:
+                    self.writing = False
+                    return
+                self.buffer_count -= item[3]
+                self.next_index += 1
+            try:
+                self.write_item(*item[:3])
+            except Exception as e:
+                # e.g. ffmpeg exited early, stop merging but keep downloading the segments
+                with self.lock:
+                    self.error = e
+                    self.writing = False
+                return
+
+    def write_item(self, data, path, is_spilled):
+        if data is None and path is None:
+            self.skipped_count += 1
+            return
+        if data is not None:
+            self.output.write(data)
+            size = len(data)
+        else:
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, self.output, 1024 * 1024)
+                size = f.tell()
+            if is_spilled:
+                os.remove(path)
+        self.written_count += 1
+        self.written_size += size
+        self.last_write_time = time.time()
+        if self.first_write_time is None:
+            self.first_write_time = self.last_write_time
+
+    def finish(self):
+        # segments stuck behind a missing one are moved to files so nothing that was downloaded gets lost
+        with self.lock:
+            leftovers = sorted(self.pending.items())
+            self.pending.clear()
+            self.buffer_count = 0
+        for index, (data, path, is_spilled, is_buffered) in leftovers:
+            if data is not None and path is None:
+                with open(self.get_spill_path(index), "wb") as f:
+                    f.write(data)
+        return [index for index, item in leftovers]
@@ -0,0 +1,187 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COUNTER = "counter"
+GAUGE = "gauge"
+SUMMARY = "summary"
+
+
+def get_key(name, labels):
+    # label values are strings like in the exposition format, so status=206 and status="error" still sort
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Metrics:
+    # counters, gauges and timings of the download hot paths, every update is also handed to the exporters as an
+    # event dict, so a callback, a json lines file or a prometheus endpoint can all be attached to the same object
+    def __init__(self, prefix="downloader", exporters=None):
+        self.prefix = prefix
+        self.exporters = list(exporters or list())
+        self.lock = threading.Lock()
+        self.types = dict()
+        self.values = dict()
+        for exporter in self.exporters:
+            exporter.attach(self)
+
+    def add_exporter(self, exporter):
+        exporter.attach(self)
+        self.exporters.append(exporter)
+
+    def emit(self, metric_type, name, value, labels):
+        if not self.exporters:
+            return
+        event = {"time": time.time(), "type": metric_type, "metric": f"{self.prefix}_{name}", "value": value}
+        if labels:
+            event["labels"] = labels
+        for exporter in self.exporters:
+            exporter.export(event)
+
+    def inc(self, name, value=1, **labels):
+        key = get_key(name, labels)
+        with self.lock:
+            self.types[name] = COUNTER
+            self.values[key] = self.values.get(key, 0) + value
+        self.emit(COUNTER, name, value, labels)
+
+    def set(self, name, value, **labels):
+        key = get_key(name, labels)
+        with self.lock:
+            self.types[name] = GAUGE
+            self.values[key] = value
+        self.emit(GAUGE, name, value, labels)
+
+    def observe(self, name, value, **labels):
+        # count / sum / max of e.g. latencies, average = sum / count
+        key = get_key(name, labels)
+        with self.lock:
+            self.types[name] = SUMMARY
+            count, total, maximum = self.values.get(key, (0, 0, 0))
+            self.values[key] = (count + 1, total + value, max(maximum, value))
+        self.emit(SUMMARY, name, value, labels)
+
+    def snapshot(self):
+        with self.lock:
+            items = list(self.values.items())
+            types = dict(self.types)
+        result = list()
+        for (name, labels), value in sorted(items, key=lambda item: item[0]):
+            item = {"metric": f"{self.prefix}_{name}", "type": types[name], "labels": dict(labels)}
+            if types[name] == SUMMARY:
+                item.update({"count": value[0], "sum": value[1], "max": value[2]})
+            else:
+                item["value"] = value
+            result.append(item)
+        return result
+
+    def export_summary(self):
+        # one event with all aggregated values, e.g. at the end of a download
+        if not self.exporters:
+            return
+        event = {"time": time.time(), "type": "snapshot", "metric": self.prefix, "value": self.snapshot()}
+        for exporter in self.exporters:
+            exporter.export(event)
+
+    def close(self):
+        for exporter in self.exporters:
+            exporter.close()
+
+
+class CallbackExporter:
+    # calls func(event) for every update, func runs on the downloading thread and should be quick
+    def __init__(self, func):
+        self.func = func
+
+    def attach(self, metrics):
+        pass
+
+    def export(self, event):
+        self.func(event)
+
+    def close(self):
+        pass
+
+
+class JsonLinesExporter:
+    # one json object per line, every update and the summaries
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.file = open(path, "a", encoding="utf-8")
+
+    def attach(self, metrics):
+        pass
+
+    def export(self, event):
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with self.lock:
+            if not self.file.closed:
+                self.file.write(line)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in sorted(labels.items())) + "}"
+
+
+def format_prometheus(snapshot):
+    lines = list()
+    typed = set()
+    for item in snapshot:
+        name = item["metric"]
+        labels = format_labels(item["labels"])
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {item['type']}")
+        if item["type"] == SUMMARY:
+            lines.append(f"{name}_count{labels} {item['count']}")
+            lines.append(f"{name}_sum{labels} {item['sum']}")
+        else:
+            lines.append(f"{name}{labels} {item['value']}")
+    return "\n".join(lines) + "\n"
+
+
+class PrometheusExporter:
+    # serves the aggregated values in the prometheus text format on http://host:port/metrics for a local scrape
+    def __init__(self, port=9100, host="127.0.0.1"):
+        self.metrics_list = list()
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = "".join(format_prometheus(metrics.snapshot()) for metrics in exporter.metrics_list).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name="PrometheusExporter", daemon=True)
+        self.thread.start()
+
+    def attach(self, metrics):
+        self.metrics_list.append(metrics)
+
+    def export(self, event):
+        # scraped on demand, nothing to do per update
+        pass
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
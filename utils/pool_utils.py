@@ -0,0 +1,52 @@
+import itertools
+import logging
+import queue
+import threading
+
+STOP = object()
+
+
+class WorkerPool:
+    # a fixed number of threads consuming jobs from a priority queue, lower priority values run first
+    def __init__(self, worker_count, handler, name="worker", logger=None):
+        self.worker_count = max(worker_count, 1)
+        self.handler = handler
+        self.name = name
+        self.logger = logger if logger else logging.getLogger(name)
+        self.queue = queue.PriorityQueue()
+        # keeps jobs with the same priority in submit order and avoids comparing the jobs themselves
+        self.counter = itertools.count()
+        self.threads = list()
+
+    def __len__(self):
+        return self.queue.qsize()
+
+    def start(self):
+        for i in range(self.worker_count):
+            thread = threading.Thread(target=self.work, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def submit(self, job, priority=0):
+        self.queue.put((priority, next(self.counter), job))
+
+    def work(self):
+        while True:
+            priority, count, job = self.queue.get()
+            if job is STOP:
+                break
+            try:
+                self.handler(job)
+            except Exception as e:
+                self.logger.error(f"{self.name} job {job} meets error: {e}")
+
+    def close(self):
+        # stop markers sort after every job, so workers drain the queue before they exit
+        for _ in self.threads:
+            self.queue.put((float("inf"), next(self.counter), STOP))
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+        self.threads.clear()
@@ -0,0 +1,98 @@
+import asyncio
+import sys
+import threading
+import time
+
+
+class TokenBucket:
+    # bandwidth limit in bytes per second that any number of threads (and downloads) can share, a chunk takes its
+    # tokens right away and goes into debt if there aren't enough, the caller then sleeps off the debt outside the
+    # lock, so the lock is only held for a few arithmetic operations per chunk
+    def __init__(self, rate, burst=None):
+        if not rate or rate <= 0:
+            raise Exception(f"rate must be a positive number of bytes per second, got: {rate}")
+        self.rate = rate
+        # a quarter of a second at full rate can go out at once after an idle period
+        self.burst = burst if burst and burst > 0 else rate / 4
+        self.tokens = self.burst
+        self.last_time = time.monotonic()
+        self.lock = threading.Lock()
+        self.waited_time = 0
+
+    def reserve(self, size):
+        # takes size tokens and returns how many seconds the caller has to wait before sending more
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.tokens + (now - self.last_time) * self.rate, self.burst) - size
+            self.last_time = now
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+            self.waited_time += delay
+            return delay
+
+    def consume(self, size):
+        delay = self.reserve(size)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def get_delay(buckets, size):
+    # a chunk that passes several limits (e.g. its own download and the whole process) waits for the slowest
+    return max((bucket.reserve(size) for bucket in buckets), default=0)
+
+
+def limit_rate(buckets, size):
+    # sleeps until a chunk of size bytes may pass
+    if buckets:
+        delay = get_delay(buckets, size)
+        if delay > 0:
+            time.sleep(delay)
+
+
+async def limit_rate_async(buckets, size):
+    # the same without blocking the event loop
+    if buckets:
+        delay = get_delay(buckets, size)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def get_buckets(max_speed=None, rate_limiter=None):
+    # max_speed: bytes per second for this download only, rate_limiter: a TokenBucket shared with other downloads
+    buckets = list()
+    if max_speed:
+        buckets.append(TokenBucket(max_speed))
+    if rate_limiter:
+        buckets.append(rate_limiter)
+    return buckets
+
+
+def benchmark_token_bucket(thread_count=16, chunk_count=20000, chunk_size=1024 * 64, rate=1024 * 1024 * 100):
+    def run(bucket, count):
+        # every thread pushes count chunks through the same bucket
+        def worker():
+            for _ in range(count):
+                bucket.consume(chunk_size)
+
+        threads = [threading.Thread(target=worker) for _ in range(thread_count)]
+        start_time = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start_time
+
+    # cost of the limiter itself, with a rate that never makes anybody wait
+    spent_time = run(TokenBucket(1024 ** 5), chunk_count)
+    total_count = thread_count * chunk_count
+    print("{} threads, {} chunks: {:.2f} us per chunk, {:.0f} chunks per second".format(
+        thread_count, total_count, spent_time / total_count * 1000000, total_count / spent_time))
+    # accuracy, about two seconds worth of data at rate
+    count = rate * 2 // chunk_size // thread_count
+    spent_time = run(TokenBucket(rate, burst=chunk_size), count)
+    print("limited to {:.2f} MB/s, measured {:.2f} MB/s".format(
+        rate / (1024 * 1024), count * thread_count * chunk_size / (1024 * 1024) / spent_time))
+
+
+if __name__ == '__main__':
+    # python -m utils.rate_utils [thread_count]
+    benchmark_token_bucket(thread_count=int(sys.argv[1]) if len(sys.argv) > 1 else 16)
@@ -0,0 +1,85 @@
+import random
+import threading
+import time
+
+# worth another try: timeouts, throttling and server side errors
+RETRYABLE_STATUS_CODES = (408, 425, 429, 500, 502, 503, 504)
+
+
+def is_retryable_status(status_code):
+    # other client errors (403, 404, 410, 416, ...) won't go away by asking again
+    if status_code in RETRYABLE_STATUS_CODES:
+        return True
+    return not 400 <= status_code < 500 and status_code not in (501, 505)
+
+
+def parse_retry_after(value):
+    # only the delay-seconds form, an HTTP date is ignored
+    try:
+        return max(float(value), 0) if value else None
+    except ValueError:
+        return None
+
+
+class RetryPolicy:
+    # how often and how long to wait between attempts, shared by all workers of a download: exponential backoff
+    # with full jitter (random between 0 and base_delay * 2 ** retry, capped at max_delay), a Retry-After header
+    # of the server wins if it is longer
+    def __init__(self, retry_times=5, base_delay=0.5, max_delay=30.0):
+        self.retry_times = max(retry_times, 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.retry_count = 0
+        self.fatal_count = 0
+        self.exhausted_count = 0
+        self.refetched_size = 0
+        self.backoff_time = 0
+
+    def is_retryable(self, status_code):
+        return is_retryable_status(status_code)
+
+    def get_delay(self, retry, retry_after=None):
+        # retry: 0 before the first retry, 1 before the second one...
+        delay = random.uniform(0, min(self.base_delay * 2 ** retry, self.max_delay))
+        retry_after = parse_retry_after(retry_after)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        with self.lock:
+            self.retry_count += 1
+            self.backoff_time += delay
+        return delay
+
+    def wait(self, retry, retry_after=None):
+        time.sleep(self.get_delay(retry, retry_after))
+
+    def record_refetch(self, size):
+        # bytes of a failed attempt that have to be downloaded again
+        if size:
+            with self.lock:
+                self.refetched_size += size
+
+    def record_fatal(self):
+        with self.lock:
+            self.fatal_count += 1
+
+    def record_exhausted(self):
+        with self.lock:
+            self.exhausted_count += 1
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "retries": self.retry_count,
+                "fatal": self.fatal_count,
+                "exhausted": self.exhausted_count,
+                "refetched_size": self.refetched_size,
+                "backoff_time": self.backoff_time,
+            }
+
+
+def format_retry_stats(stats, name="retries", unit="pages"):
+    # unit: what runs out of retries, e.g. the pages of a file or the segments of a video
+    return "{}: {}, fatal responses: {}, {} out of retries: {}, bytes re-fetched: {}, backoff time: {:.2f} " \
+           "second".format(name, stats["retries"], stats["fatal"], unit, stats["exhausted"], stats["refetched_size"],
+                           stats["backoff_time"])
@@ -0,0 +1,151 @@
+import sys
+import threading
+import time
+from collections import deque
+
+
+def percentile(values, percent):
+    if not values:
+        return 0
+    values = sorted(values)
+    index = min(int(round(percent / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+class RangeScheduler:
+    # hands out small pages of byte ranges (inclusive) to workers, once the queue is empty an idle worker
+    # steals the second half of the largest page another worker is still downloading
+    def __init__(self, ranges, page_size, min_steal_size):
+        self.page_size = max(page_size, 1)
+        self.min_steal_size = max(min_steal_size, 1)
+        self.pending = deque()
+        self.active = dict()
+        self.lock = threading.Lock()
+        self.page_times = list()
+        self.failed_pages = list()
+        self.steal_count = 0
+        self.start_time = time.time()
+        self.first_idle_time = None
+        self.last_finish_time = None
+        for start_pos, end_pos in ranges:
+            while end_pos - start_pos + 1 > self.page_size:
+                self.pending.append({"start_pos": start_pos, "end_pos": start_pos + self.page_size - 1})
+                start_pos += self.page_size
+            self.pending.append({"start_pos": start_pos, "end_pos": end_pos})
+
+    def __len__(self):
+        return len(self.pending)
+
+    def next_page(self, worker_name):
+        with self.lock:
+            page = self.pending.popleft() if self.pending else self.steal()
+            if page:
+                self.active[worker_name] = page
+            elif self.first_idle_time is None:
+                self.first_idle_time = time.time()
+            return page
+
+    def steal(self):
+        victim = max(self.active.values(), key=lambda p: p["end_pos"] - p["start_pos"], default=None)
+        if not victim:
+            return
+        remaining = victim["end_pos"] - victim["start_pos"] + 1
+        # the owner may be writing one chunk past start_pos, min_steal_size keeps the split point beyond it
+        if remaining < self.min_steal_size * 2:
+            return
+        split_pos = victim["start_pos"] + remaining // 2
+        page = {"start_pos": split_pos, "end_pos": victim["end_pos"]}
+        victim["end_pos"] = split_pos - 1
+        self.steal_count += 1
+        return page
+
+    def claim(self, page, size):
+        # how many of the next `size` bytes still belong to the page, it may have been shrunk by a steal
+        with self.lock:
+            return max(min(size, page["end_pos"] - page["start_pos"] + 1), 0)
+
+    def get_range(self, page):
+        # what is left of the page right now, None once it is done or stolen completely
+        with self.lock:
+            if page["start_pos"] > page["end_pos"]:
+                return None
+            return page["start_pos"], page["end_pos"]
+
+    def advance(self, page, size):
+        with self.lock:
+            page["start_pos"] += size
+
+    def finish_page(self, worker_name, page, spent_time, is_success):
+        with self.lock:
+            self.active.pop(worker_name, None)
+            self.page_times.append(spent_time)
+            self.last_finish_time = time.time()
+            if not is_success:
+                self.failed_pages.append(page)
+
+    def get_stats(self):
+        with self.lock:
+            page_times = list(self.page_times)
+            first_idle_time = self.first_idle_time or self.last_finish_time or self.start_time
+            last_finish_time = self.last_finish_time or self.start_time
+            return {
+                "pages": len(page_times),
+                "steals": self.steal_count,
+                "failed_pages": len(self.failed_pages),
+                "p50": percentile(page_times, 50),
+                "p90": percentile(page_times, 90),
+                "p99": percentile(page_times, 99),
+                "max": max(page_times, default=0),
+                # time between the first worker running out of work and the last worker finishing
+                "tail_time": max(last_finish_time - first_idle_time, 0),
+                "total_time": last_finish_time - self.start_time,
+            }
+
+
+def static_pages(total_size, thread_count):
+    page_size = total_size // thread_count
+    return [[i * page_size, total_size - 1 if i == thread_count - 1 else (i + 1) * page_size - 1]
+            for i in range(thread_count)]
+
+
+def benchmark_scheduler(total_size=1024 * 1024 * 200, thread_count=8, chunk_size=1024 * 256,
+                        fast_speed=1024 * 1024 * 100, slow_speed=1024 * 1024 * 10):
+    # simulated download where worker 0 sits behind a slow edge, compares static pages with work stealing
+    def simulate(scheduler):
+        def worker(worker_name):
+            speed = slow_speed if worker_name == 0 else fast_speed
+            while True:
+                page = scheduler.next_page(worker_name)
+                if not page:
+                    break
+                start_time = time.time()
+                while True:
+                    size = scheduler.claim(page, chunk_size)
+                    if not size:
+                        break
+                    time.sleep(size / speed)
+                    scheduler.advance(page, size)
+                scheduler.finish_page(worker_name, page, time.time() - start_time, True)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return scheduler.get_stats()
+
+    schedulers = (
+        ("static", lambda: RangeScheduler(static_pages(total_size, thread_count), total_size, total_size)),
+        ("work stealing", lambda: RangeScheduler([[0, total_size - 1]], total_size // (thread_count * 4),
+                                                 chunk_size * 2)),
+    )
+    for name, get_scheduler in schedulers:
+        stats = simulate(get_scheduler())
+        print("{:>13}: total {:.2f}s, tail {:.2f}s, pages {}, steals {}, page p50 {:.2f}s p99 {:.2f}s".format(
+            name, stats["total_time"], stats["tail_time"], stats["pages"], stats["steals"], stats["p50"], stats["p99"]
+        ))
+
+
+if __name__ == '__main__':
+    # python -m utils.scheduler_utils [thread_count]
+    benchmark_scheduler(thread_count=int(sys.argv[1]) if len(sys.argv) > 1 else 8)
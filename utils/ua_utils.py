@@ -0,0 +1,57 @@
+import json
+import os
+import random
+import threading
+import timeit
+
+UA_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_useragent_0.1.11.json")
+
+
+class UserAgentPool:
+    # the fake_useragent data file is parsed once per process, on first use
+    def __init__(self, path=UA_FILE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.browsers = None
+        self.slots = None
+
+    def load(self):
+        if self.browsers is None:
+            with self.lock:
+                if self.browsers is None:
+                    with open(self.path, encoding="utf-8") as f:
+                        data = json.load(f)
+                    browsers = {name: tuple(uas) for name, uas in data["browsers"].items() if uas}
+                    # "randomize" maps slots to browser names, picking a random slot keeps fake_useragent's weights
+                    self.slots = tuple(name for name in data["randomize"].values() if name in browsers)
+                    self.browsers = browsers
+        return self.browsers
+
+    def random(self):
+        browsers = self.load()
+        return random.choice(browsers[random.choice(self.slots)])
+
+
+USER_AGENT_POOL = UserAgentPool()
+
+
+def get_user_agent():
+    return USER_AGENT_POOL.random()
+
+
+def benchmark_user_agent(number=2000):
+    cached_time = timeit.timeit(get_user_agent, number=number)
+    print("User-Agent header from the cached pool: %.2f us per call" % (cached_time / number * 1000000))
+    try:
+        from fake_useragent import UserAgent
+    except ImportError:
+        print("fake_useragent is not installed, skip the uncached comparison")
+        return
+    uncached_number = max(number // 20, 1)
+    uncached_time = timeit.timeit(lambda: UserAgent(path=UA_FILE_PATH).random, number=uncached_number)
+    print("User-Agent header from UserAgent(path=...): %.2f us per call" % (uncached_time / uncached_number * 1000000))
+
+
+if __name__ == '__main__':
+    # python -m utils.ua_utils
+    benchmark_user_agent()
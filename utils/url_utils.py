@@ -0,0 +1,111 @@
+import sys
+import time
+from urllib.parse import urljoin, urlsplit
+
+
+def join_overlap(base_url, raw_url):
+    # the old heuristic: the longest start of raw_url that also occurs in base_url is taken as the overlap of both
+    # and dropped once, e.g. "http://a/hls" + "hls/s0.ts" -> "http://a/hls/s0.ts", if a prefix is missing from
+    # base_url all longer prefixes are too, so the longest one is found by bisection instead of trying every length
+    low, high = 0, len(raw_url)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if base_url.rfind(raw_url[:middle]) == -1:
+            high = middle - 1
+        else:
+            low = middle
+    last_find_str = raw_url[:low]
+    sep = "" if base_url.endswith("/") or raw_url.startswith("/") else "/"
+    if len(last_find_str) > 2 and base_url.endswith(last_find_str):
+        return f"{base_url}{sep}{raw_url.replace(last_find_str, '')}"
+    return f"{base_url}{sep}{raw_url}"
+
+
+def get_path(raw_url):
+    return raw_url.split("#", 1)[0].split("?", 1)[0]
+
+
+def is_simple_path(path):
+    # no scheme, no authority, no empty and no "." / ".." segments: joining is plain string concatenation
+    if not path or "//" in path or ":" in path.split("/", 1)[0]:
+        return False
+    segments = path.split("/")
+    return "." not in segments and ".." not in segments
+
+
+class UrlResolver:
+    # resolves the uris of a playlist against its base url (RFC 3986 5.2), the base is parsed once, paths without
+    # "." / ".." segments (nearly every segment uri) are appended to its directory or origin and everything else
+    # goes through urljoin, compat=True uses the old overlap heuristic with base_url as a directory instead
+    def __init__(self, base_url, compat=False):
+        self.base_url = base_url
+        self.compat = compat
+        parts = urlsplit(base_url)
+        self.origin = f"{parts.scheme}://{parts.netloc}"
+        self.base_dir = f"{self.origin}{parts.path.rsplit('/', 1)[0]}/"
+        self.has_path = parts.path.startswith("/")
+
+    def resolve(self, raw_url):
+        raw_url = raw_url.strip()
+        if not raw_url or raw_url.startswith("#"):
+            return None
+        if raw_url.startswith(("http://", "https://")):
+            return raw_url
+        if self.compat:
+            return join_overlap(self.base_url, raw_url)
+        path = get_path(raw_url)
+        if not self.has_path or not is_simple_path(path):
+            return urljoin(self.base_url, raw_url)
+        return (self.origin if path.startswith("/") else self.base_dir) + raw_url
+
+    def resolve_all(self, raw_urls):
+        # one pass over the whole playlist, repeated uris (e.g. the key of every segment) are resolved once
+        resolved = dict()
+        result = list()
+        for raw_url in raw_urls:
+            url = resolved.get(raw_url)
+            if url is None and raw_url not in resolved:
+                url = resolved[raw_url] = self.resolve(raw_url)
+            result.append(url)
+        return result
+
+
+def benchmark_url_resolver(count=10000):
+    base_url = "https://cdn.example.com/vod/2024/06/some-show/episode-01/1080p/index.m3u8"
+    raw_urls = [f"1080p/segment_{i:05d}.ts?token=abcdef0123456789" for i in range(count)]
+    raw_urls += [f"/vod/2024/06/some-show/episode-01/1080p/segment_{i:05d}.ts" for i in range(count)]
+    raw_urls += [f"segment_{i:05d}.ts" for i in range(count)]
+    directory = base_url.rsplit("/", 1)[0]
+
+    def join_linear(raw_url):
+        # the old per prefix scan, for comparison
+        last_find_str = ""
+        for i in range(1, len(raw_url) + 1):
+            if directory.rfind(raw_url[:i]) == -1:
+                break
+            last_find_str = raw_url[:i]
+        sep = "" if directory.endswith("/") or raw_url.startswith("/") else "/"
+        if len(last_find_str) > 2 and directory.endswith(last_find_str):
+            return f"{directory}{sep}{raw_url.replace(last_find_str, '')}"
+        return f"{directory}{sep}{raw_url}"
+
+    cases = (
+        ("linear scan (old)", lambda: [join_linear(raw_url) for raw_url in raw_urls]),
+        ("compat", lambda: UrlResolver(directory, compat=True).resolve_all(raw_urls)),
+        ("urljoin", lambda: [urljoin(base_url, raw_url) for raw_url in raw_urls]),
+        ("rfc 3986", lambda: UrlResolver(base_url).resolve_all(raw_urls)),
+    )
+    results = dict()
+    for name, func in cases:
+        start_time = time.perf_counter()
+        results[name] = func()
+        spent_time = time.perf_counter() - start_time
+        print("{:<18} {} uris: {:.2f} ms, {:.2f} us per uri".format(
+            name, len(raw_urls), spent_time * 1000, spent_time / len(raw_urls) * 1000000))
+    print("compat matches the linear scan:", results["compat"] == results["linear scan (old)"])
+    print("rfc 3986 matches urljoin:", results["rfc 3986"] == results["urljoin"])
+
+
+if __name__ == '__main__':
+    # python -m utils.url_utils [segment_count]
+    benchmark_url_resolver(count=int(sys.argv[1]) if len(sys.argv) > 1 else 10000)